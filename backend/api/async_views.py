@@ -0,0 +1,101 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.urls import path
+from rest_framework.renderers import JSONRenderer
+
+from .cache import cached_response, reference_cache
+from .search import ingredient_index
+from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+
+def offload(func):
+    """
+    Выполняет синхронную функцию в пуле потоков, не блокируя цикл событий.
+
+    Потоки пула не получают сигналов начала и конца запроса, поэтому
+    устаревшие соединения закрываются (или возвращаются в пул
+    соединений) до и после вызова.
+    """
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)
+
+
+def async_view(viewset, actions):
+    """
+    Асинхронная обёртка DRF-представления.
+
+    Обработка запроса, включая аутентификацию, ORM и рендеринг,
+    выполняется в пуле потоков, а цикл событий в это время
+    обслуживает остальные соединения.
+    """
+    view = viewset.as_view(actions)
+
+    def render(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    @wraps(view)
+    async def dispatch(request, *args, **kwargs):
+        return await offload(render)(request, *args, **kwargs)
+    return dispatch
+
+
+def reference_list(viewset):
+    """
+    Список справочника из кэша готовых ответов.
+
+    При попадании в кэш ответ формируется в цикле событий без потоков
+    и обращений к базе; промах обрабатывается DRF-представлением
+    в пуле потоков, которое и заполняет кэш.
+    """
+    key = viewset.queryset.model._meta.label_lower
+    view = async_view(viewset, {'get': 'list'})
+
+    @wraps(view)
+    async def dispatch(request, *args, **kwargs):
+        entry = reference_cache.lookup(key)
+        if request.method != 'GET' or entry is None:
+            return await view(request, *args, **kwargs)
+        return cached_response(request, *entry)
+    return dispatch
+
+
+def ingredient_list(view):
+    """Поиск ингредиентов по индексу в цикле событий, пока он актуален."""
+    @wraps(view)
+    async def dispatch(request, *args, **kwargs):
+        name = request.GET.get('name')
+        if request.method != 'GET' or not name:
+            return await view(request, *args, **kwargs)
+        limit = request.GET.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+        if ingredient_index.fresh:
+            result = ingredient_index.search(name, limit=limit)
+        else:
+            result = await offload(ingredient_index.search)(name, limit=limit)
+        return HttpResponse(JSONRenderer().render(result),
+                            content_type='application/json')
+    return dispatch
+
+
+urlpatterns = [
+    path('tags/', reference_list(TagViewSet), name='tag-list'),
+    path('ingredients/', ingredient_list(reference_list(IngredientViewSet)),
+         name='ingredient-list'),
+    path('recipes/',
+         async_view(RecipeViewSet, {'get': 'list', 'post': 'create'}),
+         name='recipe-list'),
+    path('recipes/<int:pk>/', async_view(RecipeViewSet, {
+        'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+        'delete': 'destroy'}), name='recipe-detail'),
+]
@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from module.constants import TOKEN_CACHE_ALIAS
+from .metrics import observe_cache
+
+
+def token_cache_key(key):
+    return f'auth-token:{key}'
+
+
+def invalidate_tokens(*keys):
+    """Удаляет токены из кэша аутентификации."""
+    caches[TOKEN_CACHE_ALIAS].delete_many(
+        [token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену с кэшем токен → идентификатор пользователя.
+
+    В кэше TOKEN_CACHE_ALIAS хранится только идентификатор владельца
+    токена, без пароля и других данных пользователя. При попадании
+    пропускается поиск по таблице токенов, а сам пользователь каждый
+    раз читается из базы по первичному ключу, поэтому деактивация
+    и смена пароля действуют сразу, в том числе сделанные через
+    queryset.update(). Записи удаляются сигналами при удалении токена
+    (в том числе при выходе через djoser) и пользователя.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = caches[TOKEN_CACHE_ALIAS]
+        user_id = cache.get(token_cache_key(key))
+        observe_cache('auth_token', user_id is not None)
+        if user_id is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(token_cache_key(key), user.pk)
+            return user, token
+        user = get_user_model()._default_manager.filter(pk=user_id).first()
+        if user is None or not user.is_active:
+            invalidate_tokens(key)
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, self.get_model()(key=key, user=user)
@@ -0,0 +1,367 @@
+"""
+Нагрузочные замеры эндпоинтов API.
+
+Наполняет базу синтетическими данными заданного объёма, прогоняет
+маршруты api/urls.py через тестовый клиент Django и собирает
+перцентили времени ответа, число SQL-запросов и время SQL
+по всем базам из DATABASES.
+"""
+import random
+import statistics
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, resolve
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import (
+    Favorite, FeedEntry, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    Subscription, Tag
+)
+from . import urls
+from .documents import recipe_documents
+from .popular import track_favorites
+
+User = get_user_model()
+
+PASSWORD = 'benchmark-password'
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAf'
+         'FcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==')
+
+
+def seed(users, recipes, ingredients, tags, favorites, carts,
+         subscriptions, batch_size=1000, rng=None):
+    """
+    Создаёт синтетические данные пакетными вставками.
+
+    favorites, carts и subscriptions задаются на одного пользователя.
+    Производные данные — документы рецептов, ленты подписок и дневные
+    счётчики избранного — строятся так же, как при работе API.
+    """
+    rng = rng or random.Random(0)
+    User.objects.bulk_create((
+        User(username=f'bench{i}', email=f'bench{i}@example.com',
+             first_name='Bench', last_name=str(i))
+        for i in range(users)
+    ), batch_size=batch_size)
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    Tag.objects.bulk_create((
+        Tag(name=f'Tag {i}', color=f'#{i % 0xFFFFFF:06X}', slug=f'tag-{i}')
+        for i in range(tags)
+    ), batch_size=batch_size)
+    tag_ids = list(Tag.objects.values_list('pk', flat=True))
+    Ingredient.objects.bulk_create((
+        Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+        for i in range(ingredients)
+    ), batch_size=batch_size)
+    ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+    Recipe.objects.bulk_create((
+        Recipe(name=f'Рецепт {i}', text=f'Описание рецепта {i}',
+               cooking_time=rng.randint(1, 120),
+               image='recipes/images/benchmark.png',
+               author_id=rng.choice(user_ids))
+        for i in range(recipes)
+    ), batch_size=batch_size)
+    recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+    Recipe.objects.update_search_vector()
+
+    through = Recipe.tags.through
+    through.objects.bulk_create((
+        through(recipe_id=pk, tag_id=tag)
+        for pk in recipe_ids
+        for tag in rng.sample(tag_ids, min(2, len(tag_ids)))
+    ), batch_size=batch_size)
+    RecipeIngredient.objects.bulk_create((
+        RecipeIngredient(recipe_id=pk, ingredient_id=ingredient,
+                         amount=rng.randint(1, 500))
+        for pk in recipe_ids
+        for ingredient in rng.sample(
+            ingredient_ids, min(5, len(ingredient_ids)))
+    ), batch_size=batch_size)
+    for model, per_user in ((Favorite, favorites), (ShoppingCart, carts)):
+        model.objects.bulk_create((
+            model(author_id=user, recipe_id=recipe)
+            for user in user_ids
+            for recipe in rng.sample(
+                recipe_ids, min(per_user, len(recipe_ids)))
+        ), batch_size=batch_size, ignore_conflicts=True)
+    Subscription.objects.bulk_create((
+        Subscription(author_id=user, subcripe_id=author)
+        for user in user_ids
+        for author in rng.sample(
+            user_ids, min(subscriptions, len(user_ids)))
+        if author != user
+    ), batch_size=batch_size, ignore_conflicts=True)
+    Recipe.objects.recount()
+    recipe_documents.rebuild(Recipe.objects.all())
+    subscriptions = defaultdict(list)
+    for user, author in Subscription.objects.values_list(
+            'author_id', 'subcripe_id'):
+        subscriptions[user].append(author)
+    for user, author_ids in subscriptions.items():
+        FeedEntry.objects.backfill(User(pk=user), author_ids)
+    track_favorites(
+        Favorite.objects.values_list('recipe_id', 'created_at'), 1)
+
+
+def route_names():
+    """
+    Имена достижимых маршрутов api/urls.py.
+
+    Маршруты, перекрытые ранее объявленными с тем же шаблоном,
+    не учитываются.
+    """
+    def walk(patterns, prefix=''):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern.url_patterns,
+                                prefix + str(pattern.pattern))
+            elif pattern.name:
+                yield prefix + str(pattern.pattern), pattern.name
+
+    names = {}
+    for regex, name in walk(urls.urlpatterns):
+        names.setdefault(regex, name)
+    return set(names.values()) - {'api-root'}
+
+
+class Context:
+    """Данные, доступные сценариям замеров."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.user = User.objects.order_by('pk').first()
+        self.user.set_password(PASSWORD)
+        self.user.save(update_fields=('password',))
+        self.token = Token.objects.get_or_create(user=self.user)[0].key
+        staff = User.objects.order_by('pk').last()
+        staff.is_staff = True
+        staff.save(update_fields=('is_staff',))
+        self.staff_token = Token.objects.get_or_create(user=staff)[0].key
+        self.recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+        self.user_ids = list(User.objects.exclude(
+            pk=self.user.pk).values_list('pk', flat=True))
+        self.tag = Tag.objects.order_by('pk').first()
+        self.ingredient = Ingredient.objects.order_by('pk').first()
+        for model in (Favorite, ShoppingCart):
+            model.objects.filter(
+                author=self.user, recipe_id=self.recipe_ids[-1]).delete()
+        self.user.subscriptions.filter(subcripe_id=self.user_ids[-1]).delete()
+
+    def recipe(self):
+        return self.rng.choice(self.recipe_ids)
+
+    def author(self):
+        return self.rng.choice(self.user_ids)
+
+
+def recipe_payload(ctx):
+    return {
+        'name': 'Рецепт для замеров', 'text': 'Описание',
+        'cooking_time': 10, 'image': IMAGE, 'tags': [ctx.tag.pk],
+        'ingredients': [{'id': ctx.ingredient.pk, 'amount': 10}],
+    }
+
+
+def scenarios():
+    """
+    Сценарии замеров.
+
+    Каждый сценарий — список шагов (method, url, data, auth). url может
+    быть функцией от контекста и ответа предыдущего шага, data — функцией
+    от контекста, auth — True, False или 'staff' для сотрудника. Шаги,
+    меняющие данные, парные, чтобы база не менялась от итерации
+    к итерации.
+    """
+    def step(method, url, data=None, auth=True):
+        return method, url, data, auth
+
+    def last_recipe(action):
+        return lambda ctx, prev: f'/api/recipes/{ctx.recipe_ids[-1]}/{action}/'
+
+    def batch(url, ids):
+        return [
+            step('post', url, lambda ctx: {'ids': ids(ctx)[-20:]}),
+            step('delete', url, lambda ctx: {'ids': ids(ctx)[-20:]}),
+        ]
+
+    def recipe_ids(ctx):
+        return ctx.recipe_ids
+
+    def user_ids(ctx):
+        return ctx.user_ids
+
+    def created(ctx, prev):
+        return f'/api/recipes/{prev["id"]}/'
+
+    subscribe = (
+        lambda ctx, prev: f'/api/users/{ctx.user_ids[-1]}/subscribe/')
+    return {
+        'recipe-list': [step('get', '/api/recipes/')],
+        'recipe-list-anonymous': [step('get', '/api/recipes/', auth=False)],
+        'recipe-list-filtered': [step(
+            'get', lambda ctx, prev: (f'/api/recipes/?tags={ctx.tag.slug}'
+                                      '&is_favorited=1&limit=20'))],
+        'recipe-list-cursor': [
+            step('get', '/api/recipes/?pagination=cursor&limit=20')],
+        'recipe-detail': [step(
+            'get', lambda ctx, prev: f'/api/recipes/{ctx.recipe()}/')],
+        'recipe-write': [
+            step('post', '/api/recipes/', recipe_payload),
+            step('patch', created,
+                 lambda ctx: {**recipe_payload(ctx), 'text': 'Изменено'}),
+            step('delete', created),
+        ],
+        'recipe-favorite': [
+            step('post', last_recipe('favorite')),
+            step('delete', last_recipe('favorite')),
+        ],
+        'recipe-shopping-cart': [
+            step('post', last_recipe('shopping_cart')),
+            step('delete', last_recipe('shopping_cart')),
+        ],
+        'recipe-favorite-batch': batch('/api/recipes/favorite/', recipe_ids),
+        'recipe-shopping-cart-batch': batch(
+            '/api/recipes/shopping_cart/', recipe_ids),
+        'recipe-cookable': [step('get', lambda ctx, prev: (
+            f'/api/recipes/cookable/?ingredients={ctx.ingredient.pk}'))],
+        'recipe-popular': [step('get', '/api/recipes/popular/')],
+        'recipe-popular-tags': [step('get', lambda ctx, prev: (
+            f'/api/recipes/popular/?window=30&tags={ctx.tag.slug}'))],
+        'recipe-download-shopping-cart': [
+            step('get', '/api/recipes/download_shopping_cart/')],
+        'tag-list': [step('get', '/api/tags/')],
+        'tag-detail': [
+            step('get', lambda ctx, prev: f'/api/tags/{ctx.tag.pk}/')],
+        'ingredient-list': [step('get', '/api/ingredients/')],
+        'ingredient-search': [
+            step('get', '/api/ingredients/?name=ингредиент 1')],
+        'ingredient-detail': [step('get', lambda ctx, prev: (
+            f'/api/ingredients/{ctx.ingredient.pk}/'))],
+        'user-list': [step('get', '/api/users/')],
+        'user-detail': [
+            step('get', lambda ctx, prev: f'/api/users/{ctx.author()}/')],
+        'user-me': [step('get', '/api/users/me/')],
+        'user-subscriptions': [
+            step('get', '/api/users/subscriptions/?recipes_limit=3')],
+        'user-feed': [step('get', '/api/users/feed/?limit=20')],
+        'user-subscribe': [step('post', subscribe), step('delete', subscribe)],
+        'user-subscribe-batch': batch('/api/users/subscribe/', user_ids),
+        'job-list': [step('get', '/api/jobs/')],
+        'job-detail': [
+            step('get', '/api/recipes/download_shopping_cart/?async=1'),
+            step('get', lambda ctx, prev: f'/api/jobs/{prev["id"]}/'),
+        ],
+        'metrics': [step('get', '/api/metrics', auth='staff')],
+        'token': [
+            step('post', '/api/auth/token/login/',
+                 lambda ctx: {'email': ctx.user.email, 'password': PASSWORD},
+                 auth=False),
+        ],
+    }
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1,
+                      round(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples):
+    """Сводка по замерам одного шага."""
+    latencies = [sample['latency'] for sample in samples]
+    return {
+        'requests': len(samples),
+        'status': sorted({sample['status'] for sample in samples}),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'queries': max(sample['queries'] for sample in samples),
+        'sql_ms': round(statistics.mean(
+            sample['sql'] for sample in samples) * 1000, 3),
+    }
+
+
+def run(iterations, warmup=2, only=None, rng=None):
+    """
+    Прогоняет сценарии и возвращает сводку по каждому шагу.
+
+    Ключ результата — имя сценария, метод и номер шага.
+    """
+    rng = rng or random.Random(0)
+    ctx = Context(rng)
+    results, covered = {}, set()
+    for name, steps in scenarios().items():
+        if only and name not in only:
+            continue
+        samples = {}
+        for iteration in range(warmup + iterations):
+            previous = None
+            for number, (method, url, data, auth) in enumerate(steps):
+                client = APIClient()
+                if auth:
+                    token = ctx.staff_token if auth == 'staff' else ctx.token
+                    client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+                path = url(ctx, previous) if callable(url) else url
+                body = data(ctx) if callable(data) else data
+                with ExitStack() as stack:
+                    captured = [
+                        stack.enter_context(CaptureQueriesContext(connection))
+                        for connection in connections.all()
+                    ]
+                    started = time.perf_counter()
+                    response = getattr(client, method)(
+                        path, body, format='json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    latency = time.perf_counter() - started
+                previous = (
+                    response.json()
+                    if not response.streaming and response.content
+                    and response['Content-Type'] == 'application/json'
+                    else None
+                )
+                if iteration < warmup:
+                    continue
+                covered.add(resolve(path.split('?')[0]).url_name)
+                samples.setdefault(
+                    f'{name} {method.upper()} #{number}', []).append({
+                        'latency': latency,
+                        'status': response.status_code,
+                        'queries': sum(len(queries) for queries in captured),
+                        'sql': sum(float(query['time'])
+                                   for queries in captured
+                                   for query in queries.captured_queries),
+                    })
+        for key, values in samples.items():
+            results[key] = summarize(values)
+    uncovered = [] if only else sorted(route_names() - covered)
+    return results, uncovered
+
+
+def compare(current, baseline, threshold):
+    """
+    Сравнивает результаты с базовыми.
+
+    Регрессией считается рост p95 больше чем в threshold раз или рост
+    числа SQL-запросов.
+    """
+    regressions = []
+    for key, result in current.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append(
+                f'{key}: queries {base["queries"]} -> {result["queries"]}')
+        if result['p95_ms'] > base['p95_ms'] * threshold:
+            regressions.append(
+                f'{key}: p95 {base["p95_ms"]} -> {result["p95_ms"]} ms')
+    return regressions
@@ -0,0 +1,102 @@
+import hashlib
+import threading
+import time
+
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+
+from module.constants import REFERENCE_CACHE_TTL
+from recipes.models import Tag
+from .metrics import observe_cache
+from .replicas import use_primary
+
+
+class ReferenceDataCache:
+    """
+    Кэш готовых JSON-ответов справочников в памяти процесса.
+
+    Хранит отрендеренное тело ответа и его хэш для ETag. Записи
+    сбрасываются сигналами при изменении справочников и по истечении
+    REFERENCE_CACHE_TTL, чтобы подхватить изменения из других процессов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def lookup(self, key):
+        """Возвращает пару (тело, etag) или None, если записи нет."""
+        entry = self._entries.get(key)
+        hit = (entry is not None
+               and time.monotonic() - entry[2] <= REFERENCE_CACHE_TTL)
+        observe_cache(key, hit)
+        return entry[:2] if hit else None
+
+    def get(self, key, build):
+        """
+        Возвращает пару (тело, etag) для ключа.
+
+        build вызывается только при отсутствии или устаревании записи
+        и должен вернуть данные для сериализации в JSON.
+        """
+        entry = self.lookup(key)
+        if entry is None:
+            with use_primary():
+                data = build()
+            body = JSONRenderer().render(data)
+            entry = (body, '"%s"' % hashlib.md5(body).hexdigest())
+            with self._lock:
+                self._entries[key] = (*entry, time.monotonic())
+        return entry
+
+    def invalidate(self, key):
+        """Сбрасывает запись кэша."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SlugMap:
+    """
+    Отображение slug → id справочника в памяти процесса.
+
+    Сбрасывается сигналами при изменении справочника и по истечении
+    REFERENCE_CACHE_TTL, как и кэш ответов справочников.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self._entry = None
+
+    def get(self):
+        """Возвращает словарь slug → id, при необходимости строя его."""
+        entry = self._entry
+        hit = (entry is not None
+               and time.monotonic() - entry[1] <= REFERENCE_CACHE_TTL)
+        observe_cache(f'{self.model._meta.label_lower}.slug', hit)
+        if hit:
+            return entry[0]
+        with use_primary():
+            slugs = dict(self.model.objects.values_list('slug', 'id'))
+        with self._lock:
+            self._entry = (slugs, time.monotonic())
+        return slugs
+
+    def invalidate(self):
+        """Сбрасывает отображение."""
+        with self._lock:
+            self._entry = None
+
+
+def cached_response(request, body, etag):
+    """Ответ из кэша с ETag; 304, если клиент прислал тот же ETag."""
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
+reference_cache = ReferenceDataCache()
+tag_slugs = SlugMap(Tag)
@@ -0,0 +1,61 @@
+import threading
+
+from django.db import transaction
+
+from module.constants import RECIPE_DOCUMENT_BATCH_SIZE
+from recipes.models import Recipe
+from .popular import popular_recipes
+from .replicas import use_primary
+from .search import recipe_index
+from .serializers import RecipeDocumentSerializer
+
+
+class RecipeDocuments(threading.local):
+    """
+    Перестроение готовых документов рецептов.
+
+    Изменения рецептов, тегов и ингредиентов копятся в рамках
+    транзакции, и документы затронутых рецептов перестраиваются один
+    раз после её фиксации, когда связи рецепта уже сохранены. Документы
+    рецептов автора после изменения его профиля перестраивает фоновая
+    задача rebuild_author_documents. Вместе с документом обновляются
+    индекс ингредиентов рецепта и его теги в рейтинге популярных.
+    """
+
+    def __init__(self):
+        self._pending = set()
+
+    def schedule(self, recipe_ids):
+        """Перестраивает документы рецептов после фиксации транзакции."""
+        self._pending.update(recipe_ids)
+        transaction.on_commit(self.flush)
+
+    def flush(self):
+        recipe_ids, self._pending = self._pending, set()
+        if recipe_ids:
+            self.rebuild(Recipe.objects.filter(pk__in=recipe_ids))
+
+    @staticmethod
+    @use_primary()
+    def rebuild(queryset, batch_size=RECIPE_DOCUMENT_BATCH_SIZE):
+        """Строит документы рецептов queryset пакетами по batch_size."""
+        queryset = queryset.order_by('pk')
+        last_id, updated = 0, 0
+        while True:
+            batch = list(queryset.filter(
+                pk__gt=last_id).with_relations()[:batch_size])
+            if not batch:
+                return updated
+            for recipe in batch:
+                recipe.document = RecipeDocumentSerializer(recipe).data
+                recipe_index.update(recipe.pk, (
+                    item.ingredient_id
+                    for item in recipe.recipeingredient_set.all()))
+                popular_recipes.retag(
+                    recipe.pk, [tag.pk for tag in recipe.tags.all()])
+            Recipe.objects.bulk_update(batch, ['document'])
+            updated += len(batch)
+            last_id = batch[-1].pk
+
+
+recipe_documents = RecipeDocuments()
@@ -1,19 +1,39 @@
-from django.db.models import Q
-from django_filters import AllValuesMultipleFilter, rest_framework as filters
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, TrigramSimilarity
+)
+from django.db.models import Exists, F, OuterRef, Q
+from django_filters import rest_framework as filters
 
-from recipes.models import Recipe, Ingredient
+from module.constants import SEARCH_CONFIG
+from recipes.models import Recipe
+from .cache import tag_slugs
 
 
-class IngredientFilterSet(filters.FilterSet):
-    name = filters.CharFilter(method='filter_name')
+class TagSlugFilter(filters.MultipleChoiceFilter):
+    """
+    Фильтр рецептов по slug тегов.
 
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+    Допустимые значения берутся из отображения slug → id в памяти,
+    а рецепты отбираются подзапросом EXISTS по связям с тегами:
+    без соединения таблиц, повторов строк и DISTINCT.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('choices', self.slug_choices)
+        super().__init__(*args, **kwargs)
 
-    def filter_name(self, queryset, name, value):
-        return queryset.filter(Q(name__istartswith=value)
-                               | Q(name__icontains=value))
+    @staticmethod
+    def slug_choices():
+        return [(slug, slug) for slug in tag_slugs.get()]
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        slugs = tag_slugs.get()
+        return qs.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[slugs[slug] for slug in value if slug in slugs]
+        )))
 
 
 class RecipeFilterSet(filters.FilterSet):
@@ -21,26 +41,45 @@ class RecipeFilterSet(filters.FilterSet):
     Фильтр для рецептов.
 
     Позволяет фильтровать рецепты по различным критериям, включая теги,
-    наличие в избранном и наличие в списке покупок.
+    наличие в избранном и наличие в списке покупок, а также искать
+    рецепты по названию и описанию.
     """
-    tags = AllValuesMultipleFilter(field_name='tags__slug', label='Tags')
+    tags = TagSlugFilter(label='Tags')
     is_favorited = filters.BooleanFilter(method='filter_favorite')
     is_in_shopping_cart = filters.BooleanFilter(method='filter_shopping_cart')
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search']
 
     def filter_favorite(self, queryset, name, bool_val):
         """Фильтрует рецепты наличию в избранном для текущего пользователя."""
         author = self.request.user
         if bool_val and author.is_authenticated:
-            queryset = queryset.filter(favorites__author=author)
+            queryset = queryset.filter(is_favorited=True)
         return queryset
 
     def filter_shopping_cart(self, queryset, name, bool_val):
         """Фильтрует рецепты наличию в покупок для текущего пользователя."""
         author = self.request.user
         if bool_val and author.is_authenticated:
-            queryset = queryset.filter(shopcarts__author=author)
+            queryset = queryset.filter(is_in_shopping_cart=True)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        """
+        Полнотекстовый поиск рецептов с ранжированием.
+
+        Совпадения ищутся по поисковому вектору названия и описания,
+        а опечатки в названии покрываются триграммным сходством.
+        """
+        query = SearchQuery(value, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return queryset.annotate(
+            rank=(SearchRank(F('search_vector'), query)
+                  + TrigramSimilarity('name', value))
+        ).filter(
+            Q(search_vector=query) | Q(name__trigram_similar=value)
+        ).order_by('-rank', 'id')
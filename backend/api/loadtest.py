@@ -0,0 +1,124 @@
+"""
+Замер пропускной способности запущенного сервера.
+
+Открывает заданное число постоянных (keep-alive) HTTP/1.1-соединений
+и в течение заданного времени отправляет по каждому GET-запросы
+по кругу. Медленные клиенты передают запрос по байту с паузами,
+как клиенты на плохой сети. Используется для сравнения режимов
+SERVER_MODE=wsgi и asgi на одинаковом числе ядер.
+"""
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from .benchmark import percentile
+
+
+def build_request(url, token=None):
+    parts = urlsplit(url)
+    target = parts.path + (f'?{parts.query}' if parts.query else '')
+    headers = [f'GET {target} HTTP/1.1', f'Host: {parts.netloc}',
+               'Connection: keep-alive', 'Accept: application/json']
+    if token:
+        headers.append(f'Authorization: Token {token}')
+    return ('\r\n'.join(headers) + '\r\n\r\n').encode()
+
+
+async def read_response(reader):
+    """Читает ответ; возвращает статус и признак закрытия соединения."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip().lower()
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        return status, True
+    return status, headers.get('connection') == 'close'
+
+
+async def send(writer, request, delay):
+    """Отправляет запрос целиком или, при delay, по байту с паузами."""
+    if not delay:
+        writer.write(request)
+        return
+    for index in range(len(request)):
+        writer.write(request[index:index + 1])
+        await writer.drain()
+        await asyncio.sleep(delay)
+
+
+async def client(host, port, requests, deadline, stats, delay=0):
+    reader = writer = None
+    index = 0
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+                stats['connections'] += 1
+            started = time.perf_counter()
+            await send(writer, requests[index % len(requests)], delay)
+            index += 1
+            status, close = await read_response(reader)
+            stats['latencies'].append(time.perf_counter() - started)
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            stats['errors'] += 1
+            close = True
+            await asyncio.sleep(0.05)
+        if close and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def load(urls, clients, duration, token=None, slow_clients=0,
+               slow_delay=0.05):
+    """
+    Нагружает сервер и возвращает сводку.
+
+    Сводка считается только по обычным клиентам; slow_clients
+    медленных клиентов нагружают сервер параллельно с ними.
+    """
+    parts = urlsplit(urls[0])
+    requests = [build_request(url, token) for url in urls]
+    stats = {'latencies': [], 'statuses': {}, 'errors': 0, 'connections': 0}
+    slow_stats = {'latencies': [], 'statuses': {}, 'errors': 0,
+                  'connections': 0}
+    started = time.monotonic()
+    await asyncio.gather(*(
+        client(parts.hostname, parts.port or 80, requests[offset:]
+               + requests[:offset], started + duration, stats)
+        for offset in (index % len(requests) for index in range(clients))
+    ), *(
+        client(parts.hostname, parts.port or 80, requests,
+               started + duration, slow_stats, slow_delay)
+        for _ in range(slow_clients)
+    ))
+    elapsed = time.monotonic() - started
+    latencies = stats['latencies'] or [0]
+    return {
+        'clients': clients,
+        'slow_clients': slow_clients,
+        'duration_s': round(elapsed, 2),
+        'requests': len(stats['latencies']),
+        'rps': round(len(stats['latencies']) / elapsed, 1),
+        'errors': stats['errors'],
+        'connections': stats['connections'],
+        'status': stats['statuses'],
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
@@ -0,0 +1,297 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from backend.postgresql.pool import pools
+from module.constants import (
+    METRICS_FLUSH_INTERVAL, METRICS_LATENCY_BUCKETS, METRICS_QUERY_BUCKETS
+)
+
+METRICS = {
+    'foodgram_http_requests_total': (
+        'counter', 'Число запросов по представлению, действию и статусу.'),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Время обработки запроса.'),
+    'foodgram_db_queries_per_request': (
+        'histogram', 'Число SQL-запросов на один запрос.'),
+    'foodgram_http_requests_in_flight': (
+        'gauge', 'Запросы, обрабатываемые в данный момент.'),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к кэшам по результату (hit или miss).'),
+    'foodgram_db_pool_connections': (
+        'gauge', 'Соединения пула по состоянию (idle или in_use).'),
+    'foodgram_db_pool_connections_created_total': (
+        'counter', 'Соединения, открытые пулом.'),
+    'foodgram_db_pool_waits_total': (
+        'counter', 'Ожидания свободного соединения пула.'),
+    'foodgram_db_pool_timeouts_total': (
+        'counter', 'Запросы соединения, не дождавшиеся свободного.'),
+}
+
+
+def escape(value):
+    return (str(value).replace('\\', r'\\')
+            .replace('\n', r'\n').replace('"', r'\"'))
+
+
+def format_labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(f'{name}="{escape(value)}"'
+                             for name, value in pairs)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """
+    Счётчики, гистограммы и gauge-метрики процесса.
+
+    Если задан METRICS_DIR, фоновый поток процесса раз
+    в METRICS_FLUSH_INTERVAL секунд записывает снимок счётчиков
+    и гистограмм в отдельный файл, в том числе когда воркер простаивает.
+    Gauge-метрики при каждом изменении перезаписываются на месте в своём
+    небольшом файле, как mmap-файлы prometheus_client, чтобы другие
+    воркеры видели и увеличение, и уменьшение. При отдаче
+    метрик файлы всех воркеров gunicorn суммируются.
+    Файлы завершившихся процессов удаляются, как mark_process_dead
+    в prometheus_client: при завершении воркера, при первой записи
+    процесса с тем же PID и при сборе метрик. Счётчики после
+    перезапуска воркера уменьшаются, что Prometheus учитывает
+    как сброс счётчика.
+    """
+
+    def __init__(self, directory=''):
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._values = {}
+        self.directory = directory
+        self._pid = None
+        self.filename = None
+        self._gauges_fd = None
+        self._gauges_size = 0
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.start()
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+        if METRICS[name][0] == 'gauge':
+            self.flush_gauges()
+
+    def observe(self, name, value, buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.start()
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = {
+                    'buckets': list(buckets),
+                    'counts': [0] * len(buckets), 'sum': 0, 'count': 0}
+            for index, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self, gauges=False):
+        """Снимок gauge-метрик или остальных метрик процесса."""
+        with self._lock:
+            values = [
+                [name, labels, value if not isinstance(value, dict)
+                 else {**value, 'counts': list(value['counts'])}]
+                for (name, labels), value in self._values.items()
+                if (METRICS[name][0] == 'gauge') == gauges
+            ]
+        return values if gauges else values + list(pool_stats())
+
+    def start(self):
+        """
+        Готовит файлы процесса в METRICS_DIR и запускает фоновую запись.
+
+        Повторяется после fork: у нового процесса свой PID и свои файлы.
+        """
+        if not self.directory or self._pid == os.getpid():
+            return
+        with self._write_lock:
+            if self._pid == os.getpid():
+                return
+            pid = os.getpid()
+            self.mark_process_dead(pid)
+            os.makedirs(self.directory, exist_ok=True)
+            self.filename = f'{pid}-{time.time_ns()}'
+            if self._gauges_fd is not None:
+                os.close(self._gauges_fd)
+            self._gauges_fd = os.open(
+                os.path.join(self.directory, self.filename + '.gauges.json'),
+                os.O_WRONLY | os.O_CREAT, 0o644)
+            self._gauges_size = 0
+            self._pid = pid
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def _flush_periodically(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def _write(self, suffix, data):
+        path = os.path.join(self.directory, self.filename + suffix)
+        with self._write_lock:
+            with open(path + '.tmp', 'w') as file:
+                json.dump(data, file)
+            os.replace(path + '.tmp', path)
+
+    def flush(self):
+        """Записывает снимок счётчиков и гистограмм процесса."""
+        if self.directory:
+            self.start()
+            self._write('.json', self.snapshot())
+
+    def flush_gauges(self):
+        """
+        Записывает текущие значения gauge-метрик процесса.
+
+        Файл перезаписывается на месте, без создания и переименования:
+        запись происходит на каждом запросе. Более короткий снимок
+        дополняется пробелами до прежней длины.
+        """
+        if not self.directory:
+            return
+        self.start()
+        data = json.dumps(self.snapshot(gauges=True)).encode()
+        with self._write_lock:
+            self._gauges_size = max(self._gauges_size, len(data))
+            os.pwrite(self._gauges_fd, data.ljust(self._gauges_size), 0)
+
+    def files(self):
+        """Файлы метрик в METRICS_DIR вместе с PID процесса."""
+        try:
+            filenames = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for filename in filenames:
+            if filename.endswith('.json'):
+                yield int(filename.split('-')[0]), filename
+
+    def mark_process_dead(self, pid):
+        """Удаляет файлы метрик завершившегося процесса."""
+        if not self.directory:
+            return
+        for file_pid, filename in list(self.files()):
+            if file_pid != pid:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+
+    def snapshots(self):
+        """Снимки всех живых процессов."""
+        if not self.directory:
+            yield self.snapshot()
+            yield self.snapshot(gauges=True)
+            return
+        self.flush()
+        self.flush_gauges()
+        for pid, filename in list(self.files()):
+            if not process_alive(pid):
+                self.mark_process_dead(pid)
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            yield data
+
+    def collect(self):
+        """Суммирует метрики всех процессов."""
+        merged = {}
+        for data in self.snapshots():
+            for name, labels, value in data:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if not isinstance(value, dict):
+                    merged[key] = merged.get(key, 0) + value
+                    continue
+                total = merged.setdefault(key, {
+                    'buckets': value['buckets'],
+                    'counts': [0] * len(value['buckets']),
+                    'sum': 0, 'count': 0})
+                for index, count in enumerate(value['counts']):
+                    total['counts'][index] += count
+                total['sum'] += value['sum']
+                total['count'] += value['count']
+        return merged
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        series = defaultdict(list)
+        for (name, labels), value in sorted(self.collect().items()):
+            series[name].append((labels, value))
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for labels, value in series[name]:
+                if kind != 'histogram':
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(value['buckets'], value['counts']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket'
+                                 f'{format_labels(labels, le=bound)} '
+                                 f'{cumulative}')
+                lines += [
+                    f'{name}_bucket{format_labels(labels, le="+Inf")} '
+                    f'{value["count"]}',
+                    f'{name}_sum{format_labels(labels)} {value["sum"]}',
+                    f'{name}_count{format_labels(labels)} {value["count"]}',
+                ]
+        return '\n'.join(lines) + '\n'
+
+
+def pool_stats():
+    """Текущее состояние пулов соединений процесса."""
+    for (alias, database), pool in list(pools.items()):
+        stats = pool.stats()
+        labels = (('alias', alias), ('database', database))
+        for state in ('idle', 'in_use'):
+            yield ['foodgram_db_pool_connections',
+                   (*labels, ('state', state)), stats[state]]
+        for name in ('connections_created', 'waits', 'timeouts'):
+            yield [f'foodgram_db_pool_{name}_total', labels,
+                   stats[name.replace('connections_', '')]]
+
+
+registry = MetricsRegistry(settings.METRICS_DIR)
+
+
+def observe_request(metrics, status_code, duration):
+    """Учитывает завершённый запрос по данным инструментирования."""
+    view, _, action = (metrics.view or 'unknown').partition('.')
+    registry.inc('foodgram_http_requests_total', view=view, action=action,
+                 status=status_code)
+    registry.observe('foodgram_http_request_duration_seconds', duration,
+                     METRICS_LATENCY_BUCKETS, view=view, action=action)
+    registry.observe('foodgram_db_queries_per_request', metrics.queries,
+                     METRICS_QUERY_BUCKETS, view=view, action=action)
+
+
+def observe_cache(cache, hit):
+    registry.inc('foodgram_cache_requests_total', cache=cache,
+                 result='hit' if hit else 'miss')
@@ -0,0 +1,315 @@
+import asyncio
+import json
+import logging
+import random
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from types import MethodType
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse
+from django.utils.decorators import sync_and_async_middleware
+
+from module.constants import (
+    REPEATED_QUERY_THRESHOLD, REPLICA_PIN_COOKIE, REPLICA_PIN_SECONDS,
+    SQL_LOG_MAX_LENG
+)
+from .metrics import observe_request, registry
+from .replicas import RoutingState, routing
+
+logger = logging.getLogger(__name__)
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Замеры одного запроса: число и время SQL-запросов и фазы обработки.
+
+    Запросы передаются объекту через execute_wrapper. Тексты
+    запросов собираются только для запросов, попавших в выборку,
+    чтобы не тратить память и время на остальные.
+    """
+
+    def __init__(self, sampled):
+        self.started = perf_counter()
+        self.sampled = sampled
+        self.queries = 0
+        self.sql = 0.0
+        self.statements = Counter()
+        self.phases = {}
+        self.running = {}
+        self.view = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += perf_counter() - started
+            self.queries += 1
+            if self.sampled:
+                self.statements[sql] += 1
+
+    def start(self, name):
+        """Начинает фазу; повторный вход во вложенную фазу игнорируется."""
+        if name in self.running:
+            return False
+        self.running[name] = perf_counter(), self.sql
+        return True
+
+    def stop(self, name):
+        """Завершает фазу, не учитывая время SQL-запросов внутри неё."""
+        started = self.running.pop(name, None)
+        if started is None:
+            return
+        began, sql = started
+        elapsed = perf_counter() - began - (self.sql - sql)
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def timings(self):
+        """Длительности фаз в миллисекундах; сериализация вне фазы view."""
+        total = perf_counter() - self.started
+        phases = dict(self.phases)
+        if 'view' in phases and 'serialize' in phases:
+            phases['view'] -= phases['serialize']
+        return {
+            'db': self.sql * 1000,
+            **{name: value * 1000 for name, value in phases.items()},
+            'total': total * 1000,
+        }
+
+    def repeated(self):
+        """Одинаковые запросы, выполненные несколько раз (признак N+1)."""
+        return [
+            {'sql': sql[:SQL_LOG_MAX_LENG], 'count': count}
+            for sql, count in self.statements.most_common()
+            if count >= REPEATED_QUERY_THRESHOLD
+        ]
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """
+    Передаёт SQL-запрос замерам текущего HTTP-запроса.
+
+    Подключается к каждому соединению при его создании (сигнал
+    connection_created), поэтому учитываются и запросы из потоков,
+    куда ORM-вызовы выносятся в режиме ASGI: замеры находятся
+    по контекстной переменной, которая копируется в эти потоки.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+@contextmanager
+def phase(name):
+    """Учитывает время блока в фазе name текущего запроса."""
+    metrics = current_metrics.get()
+    if metrics is None or not metrics.start(name):
+        yield
+        return
+    try:
+        yield
+    finally:
+        metrics.stop(name)
+
+
+class InstrumentationMiddleware:
+    """
+    Считает SQL-запросы и время фаз view, serialize и render.
+
+    Результат учитывается в метриках /api/metrics и отдаётся в заголовке
+    Server-Timing сотрудникам, а при SERVER_TIMING — всем клиентам.
+    Для доли запросов INSTRUMENTATION_SAMPLE_RATE дополнительно
+    собираются тексты SQL, и медленные запросы или запросы
+    с повторяющимися SQL пишутся в журнал с ключом по представлению
+    и действию DRF.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.INSTRUMENTATION_SAMPLE_RATE
+        self.slow_ms = settings.SLOW_REQUEST_MS
+        self.server_timing = settings.SERVER_TIMING
+        registry.inc('foodgram_http_requests_in_flight', 0)
+
+    def __call__(self, request):
+        state = self.enter(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.exit(state)
+        return self.finish(request, response, state)
+
+    def enter(self, request):
+        metrics = RequestMetrics(random.random() < self.sample_rate)
+        registry.inc('foodgram_http_requests_in_flight')
+        return metrics, current_metrics.set(metrics)
+
+    def exit(self, state):
+        current_metrics.reset(state[1])
+        registry.inc('foodgram_http_requests_in_flight', -1)
+
+    def finish(self, request, response, state):
+        metrics = state[0]
+        metrics.stop('view')
+        timings = metrics.timings()
+        observe_request(metrics, response.status_code, timings['total'] / 1000)
+        if self.server_timing or self.is_staff(request):
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={value:.1f}' for name, value in timings.items()
+            ) + f', queries;desc="{metrics.queries}"'
+        if metrics.sampled:
+            self.log(request, response, metrics, timings)
+        return response
+
+    @staticmethod
+    def is_staff(request):
+        """Пользователь запроса, в том числе по токену DRF, — сотрудник."""
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return
+        view = getattr(view_func, 'cls', view_func)
+        action = getattr(view_func, 'actions', {}).get(
+            request.method.lower(), request.method.lower())
+        metrics.view = f'{view.__name__}.{action}'
+        metrics.start('view')
+
+    def process_template_response(self, request, response):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.stop('view')
+            metrics.start('render')
+            response.add_post_render_callback(
+                lambda response: metrics.stop('render'))
+        return response
+
+    def log(self, request, response, metrics, timings):
+        repeated = metrics.repeated()
+        if timings['total'] < self.slow_ms and not repeated:
+            return
+        logger.warning('slow request %s', json.dumps({
+            'view': metrics.view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': metrics.queries,
+            'timings': {name: round(value, 1)
+                        for name, value in timings.items()},
+            'repeated': repeated,
+        }, ensure_ascii=False))
+
+
+class ReplicaMiddleware:
+    """
+    Разрешает чтение с реплик для безопасных методов.
+
+    После запроса, который что-то записал, клиенту на
+    REPLICA_PIN_SECONDS ставится cookie, и его запросы читают
+    из основной базы, пока реплики не догонят запись.
+    """
+
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = self.enter(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.exit(state)
+        return self.finish(request, response, state)
+
+    def enter(self, request):
+        state = RoutingState(
+            request.method in self.safe_methods
+            and REPLICA_PIN_COOKIE not in request.COOKIES)
+        return state, routing.set(state)
+
+    def exit(self, state):
+        routing.reset(state[1])
+
+    def finish(self, request, response, state):
+        state = state[0]
+        if state.wrote and settings.REPLICA_DATABASES:
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, '1', max_age=REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax')
+        return response
+
+
+def inline(method):
+    """
+    Метод-корутина того же объекта, вызывающий синхронный хук прямо
+    в цикле событий; Django ожидает у хуков связанный объект.
+    """
+    async def hook(instance, *args):
+        return method(*args)
+    return MethodType(hook, method.__self__)
+
+
+def hybrid(middleware_class):
+    """
+    Middleware, работающая без адаптации и в WSGI, и в ASGI.
+
+    В режиме WSGI используется сам middleware_class. В режиме ASGI его
+    методы enter, exit и finish и хуки process_* выполняются прямо
+    в цикле событий, без перехода в поток: они не обращаются к базе.
+    """
+    @sync_and_async_middleware
+    def middleware(get_response):
+        instance = middleware_class(get_response)
+        if not asyncio.iscoroutinefunction(get_response):
+            return instance
+
+        async def call(request):
+            state = instance.enter(request)
+            try:
+                response = await get_response(request)
+            finally:
+                instance.exit(state)
+            return instance.finish(request, response, state)
+
+        for name in ('process_view', 'process_template_response'):
+            if hasattr(instance, name):
+                setattr(call, name, inline(getattr(instance, name)))
+        return call
+    return middleware
+
+
+instrumentation_middleware = hybrid(InstrumentationMiddleware)
+replica_middleware = hybrid(ReplicaMiddleware)
+
+
+@sync_and_async_middleware
+def streaming_middleware(get_response):
+    """
+    Собирает потоковые ответы синхронных представлений в режиме ASGI.
+
+    ASGI-обработчик Django 3.2 перебирает потоковый ответ в цикле
+    событий, где обращения к базе запрещены, поэтому содержимое,
+    которое формируется запросами ORM (список покупок), собирается
+    заранее в потоке синхронного кода. Файлы отдаются как есть.
+    """
+    if not asyncio.iscoroutinefunction(get_response):
+        raise MiddlewareNotUsed
+
+    async def middleware(request):
+        response = await get_response(request)
+        if response.streaming and not isinstance(response, FileResponse):
+            response.streaming_content = await sync_to_async(
+                list, thread_sensitive=True)(response.streaming_content)
+        return response
+    return middleware
@@ -1,7 +1,81 @@
+from django.db import transaction
 from rest_framework import viewsets, permissions
+from rest_framework.response import Response
+
+from .cache import cached_response, reference_cache
+from .serializers import BatchIdsSerializer
 
 
 class IngredientTagViewSet(viewsets.ReadOnlyModelViewSet):
-    """Представление для чтения списка ингредиентов и тегов."""
+    """
+    Представление для чтения списка ингредиентов и тегов.
+
+    Полный список отдаётся из кэша готовых ответов с ETag и без
+    обращения к базе данных; аутентификация для справочников
+    не выполняется.
+    """
     pagination_class = None
     permission_classes = (permissions.AllowAny,)
+    authentication_classes = ()
+
+    def get_cache_key(self):
+        return self.queryset.model._meta.label_lower
+
+    def list(self, request, *args, **kwargs):
+        return cached_response(request, *reference_cache.get(
+            self.get_cache_key(),
+            lambda: self.get_serializer(self.get_queryset(), many=True).data))
+
+
+class BatchRelationMixin:
+    """Пакетное добавление и удаление связей пользователя с объектами."""
+
+    def perform_batch_response(self, model, field, targets, on_change=None):
+        """
+        Добавляет (POST) или удаляет (DELETE) связи со списком объектов.
+
+        Существование объектов и связей проверяется двумя запросами,
+        добавление и удаление выполняются одним запросом каждое.
+        on_change вызывается с множеством изменённых идентификаторов
+        и знаком изменения после добавления и до удаления связей.
+        Возвращает статус для каждого идентификатора.
+
+        Найденные объекты блокируются до конца транзакции (в порядке id,
+        чтобы встречные пакеты не взаимоблокировались). Вставка связи
+        с заблокированным объектом в другой транзакции ждёт этой
+        блокировки по внешнему ключу, поэтому связи, не найденные при
+        проверке, не появятся до вставки, и on_change получает ровно
+        добавленные связи.
+        """
+        serializer = BatchIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        user = self.request.user
+
+        with transaction.atomic():
+            found = set(targets.filter(pk__in=ids).order_by(
+                'pk').select_for_update().values_list('pk', flat=True))
+            existing = set(model.objects.select_for_update().filter(
+                author=user, **{f'{field}__in': found}
+            ).values_list(field, flat=True))
+            if self.request.method == 'POST':
+                changed, delta = found - existing, 1
+                model.objects.bulk_create(
+                    (model(author=user, **{field: pk}) for pk in changed),
+                    ignore_conflicts=True)
+                done, skipped = 'added', 'exists'
+            else:
+                changed, delta = existing, -1
+                done, skipped = 'removed', 'absent'
+            if changed and on_change is not None:
+                on_change(changed, delta)
+            if delta < 0:
+                model.objects.filter(
+                    author=user, **{f'{field}__in': changed}).delete()
+
+        return Response({'results': [
+            {'id': pk,
+             'status': (done if pk in changed
+                        else skipped if pk in found else 'not_found')}
+            for pk in ids
+        ]})
@@ -1,12 +1,183 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from module.constants import PAGINATION_PAGE_SIZE
 
 
-class PageLimitPagination(pagination.PageNumberPagination):
+class KeysetPagination(pagination.BasePagination):
+    """
+    Курсорная (keyset) пагинация.
+
+    Страница выбирается условием по полям сортировки модели
+    с первичным ключом в качестве последнего поля, а не OFFSET, поэтому
+    глубокие страницы не замедляются. Общее количество объектов
+    считается только по запросу с параметром count.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    count_query_param = 'count'
+    page_size_query_param = 'limit'
+    page_size = PAGINATION_PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        self.ordering = (*queryset.model._meta.ordering, 'pk')
+        self.count = (queryset.count()
+                      if request.query_params.get(self.count_query_param)
+                      else None)
+        values, reverse = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*(
+            self.reverse_field(field) if reverse else field
+            for field in self.ordering
+        ))
+        if values is not None:
+            queryset = queryset.filter(self.keyset_filter(values, reverse))
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else values is not None
+        self.first, self.last = (results[0], results[-1]) if results else (
+            None, None)
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def keyset_filter(self, values, reverse):
+        """Условие «после» (или «до» для reverse) позиции курсора."""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            step = Q(**{f'{field.lstrip("-")}__{lookup}': values[i]})
+            for previous, value in zip(self.ordering[:i], values[:i]):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def get_field(self, name):
+        opts = self.model._meta
+        name = name.lstrip('-')
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    def decode_cursor(self, request):
+        """
+        Позиция курсора: значения полей сортировки и направление.
+
+        Значения приводятся к типам полей модели, чтобы подделанный
+        курсор давал 404, а не ошибку базы данных.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values, reverse = data['v'], bool(data['r'])
+            if len(values) != len(self.ordering) or None in values:
+                raise ValueError
+            values = [
+                field.get_prep_value(field.to_python(value))
+                for field, value in zip(
+                    map(self.get_field, self.ordering), values)
+            ]
+        except (TypeError, ValueError, KeyError, ValidationError,
+                FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, obj, reverse):
+        values = [getattr(obj, field.lstrip('-')) for field in self.ordering]
+        data = json.dumps({'v': values, 'r': reverse}, default=str)
+        url = replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            base64.urlsafe_b64encode(data.encode()).decode())
+        return remove_query_param(url, self.mode_query_param)
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first is None:
+            return None
+        return self.encode_cursor(self.first, reverse=True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+
+class OptionalKeysetMixin:
+    """
+    Включает курсорную пагинацию по запросу клиента.
+
+    Курсорный режим выбирается параметром pagination=cursor или наличием
+    курсора в запросе и только для сортировки модели по умолчанию; иначе
+    используется пагинация базового класса.
+    """
+    keyset_class = KeysetPagination
+
+    def use_keyset(self, queryset, request):
+        keyset = self.keyset_class
+        return (
+            (request.query_params.get(keyset.mode_query_param) == 'cursor'
+             or keyset.cursor_query_param in request.query_params)
+            and not queryset.query.order_by
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(queryset, request):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class PageLimitPagination(OptionalKeysetMixin,
+                          pagination.PageNumberPagination):
     """
     Пагинация с ограничением размера страницы.
     Позволяет настраивать размер страницы через параметр запроса "limit".
     """
     page_size_query_param = 'limit'
     page_size = PAGINATION_PAGE_SIZE
+
+
+class LimitOffsetKeysetPagination(OptionalKeysetMixin,
+                                  pagination.LimitOffsetPagination):
+    """Пагинация limit/offset с курсорным режимом по запросу."""
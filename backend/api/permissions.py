@@ -1,4 +1,9 @@
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, SAFE_METHODS
+from secrets import compare_digest
+
+from django.conf import settings
+from rest_framework.permissions import (
+    BasePermission, IsAuthenticatedOrReadOnly, SAFE_METHODS
+)
 
 
 class IsAuthorOrReadOnly(IsAuthenticatedOrReadOnly):
@@ -16,3 +21,14 @@ class IsAdminOrReadOnly(IsAuthenticatedOrReadOnly):
     def has_object_permission(self, request, view, obj):
         return (request.method in SAFE_METHODS
                 or request.user.is_staff)
+
+
+class IsStaffOrMetricsToken(BasePermission):
+    """Проверка разрешений: сотрудник или общий токен метрик."""
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        header = request.headers.get('Authorization', '')
+        return bool(settings.METRICS_TOKEN) and compare_digest(
+            header.encode(), f'Bearer {settings.METRICS_TOKEN}'.encode())
@@ -0,0 +1,245 @@
+import bisect
+import heapq
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from module.constants import (
+    POPULAR_REFRESH_INTERVAL, POPULAR_TOP_SIZE, POPULAR_WINDOWS
+)
+from recipes.models import FavoriteDay, Recipe
+from .replicas import use_primary
+
+
+class PopularRecipes:
+    """
+    Рейтинг рецептов по добавлениям в избранное за последние дни.
+
+    Для каждого окна из POPULAR_WINDOWS в памяти процесса хранятся
+    суммы дневных счётчиков FavoriteDay по рецептам и упорядоченные
+    списки лучших рецептов — общий и по каждому тегу. Списки держат
+    вдвое больше POPULAR_TOP_SIZE рецептов, поэтому снижение счёта
+    пересчитывает список целиком лишь после того, как из него выбыло
+    POPULAR_TOP_SIZE рецептов.
+
+    Изменения избранного в своём процессе применяются к спискам сразу
+    после фиксации транзакции; изменения из других процессов
+    подхватываются раз в POPULAR_REFRESH_INTERVAL секунд по времени
+    обновления счётчиков. Смена дня перестраивает рейтинг целиком.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._day = None
+        self._refreshed_at = None
+        self._checked_at = None
+        self._scores = {}
+        self._tags = {}
+        self._tops = {}
+        self._truncated = set()
+
+    @staticmethod
+    def _totals(queryset, today):
+        """Суммы счётчиков по рецептам для каждого окна."""
+        rows = queryset.filter(
+            day__gt=today - timedelta(days=max(POPULAR_WINDOWS))
+        ).values('recipe_id').annotate(**{
+            f'window_{window}': Sum('count', filter=Q(
+                day__gt=today - timedelta(days=window)))
+            for window in POPULAR_WINDOWS
+        })
+        return {row['recipe_id']: row for row in rows}
+
+    @use_primary()
+    def _load_tags(self, recipe_ids):
+        missing = [pk for pk in recipe_ids if pk not in self._tags]
+        tags = defaultdict(list)
+        for recipe_id, tag_id in Recipe.tags.through.objects.filter(
+                recipe_id__in=missing).values_list('recipe_id', 'tag_id'):
+            tags[recipe_id].append(tag_id)
+        for pk in missing:
+            self._tags[pk] = tuple(tags[pk])
+
+    @use_primary()
+    def build(self):
+        """Полностью перестраивает рейтинг по дневным счётчикам."""
+        with self._lock:
+            today = timezone.localdate()
+            refreshed_at = timezone.now()
+            totals = self._totals(FavoriteDay.objects.all(), today)
+            self._tags = {}
+            self._load_tags(totals)
+            self._scores = {
+                window: {
+                    pk: row[f'window_{window}'] for pk, row in totals.items()
+                    if row[f'window_{window}'] and row[f'window_{window}'] > 0
+                }
+                for window in POPULAR_WINDOWS
+            }
+            self._tops, self._truncated = {}, set()
+            for window in POPULAR_WINDOWS:
+                entries = defaultdict(list)
+                for pk, score in self._scores[window].items():
+                    for tag in (None, *self._tags[pk]):
+                        entries[tag].append((-score, -pk))
+                for tag, items in entries.items():
+                    self._fill((window, tag), items)
+            self._day, self._refreshed_at = today, refreshed_at
+            self._checked_at = time.monotonic()
+
+    @use_primary()
+    def refresh(self):
+        """Перечитывает счётчики рецептов, изменённые с прошлого чтения."""
+        with self._lock:
+            refreshed_at = timezone.now()
+            changed = FavoriteDay.objects.filter(
+                updated_at__gte=self._refreshed_at - timedelta(
+                    seconds=POPULAR_REFRESH_INTERVAL)
+            ).values('recipe_id')
+            totals = self._totals(
+                FavoriteDay.objects.filter(recipe_id__in=changed), self._day)
+            recipe_ids = set(changed.values_list('recipe_id', flat=True))
+            self._load_tags(recipe_ids)
+            for window in POPULAR_WINDOWS:
+                for pk in recipe_ids:
+                    self._set(window, pk, (totals.get(pk) or {}).get(
+                        f'window_{window}') or 0)
+            self._refreshed_at = refreshed_at
+            self._checked_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._day != timezone.localdate():
+            self.build()
+        elif time.monotonic() - self._checked_at > POPULAR_REFRESH_INTERVAL:
+            self.refresh()
+
+    def _fill(self, key, items):
+        """Заполняет список лучшими записями (-счёт, -id рецепта)."""
+        items = list(items)
+        self._tops[key] = heapq.nsmallest(2 * POPULAR_TOP_SIZE, items)
+        if len(items) > 2 * POPULAR_TOP_SIZE:
+            self._truncated.add(key)
+        else:
+            self._truncated.discard(key)
+
+    def _set(self, window, pk, score):
+        """
+        Задаёт рецепту счёт в окне и поправляет затронутые списки.
+
+        В усечённом списке все рецепты вне его имеют счёт не выше
+        последнего в списке, поэтому рецепт, опустившийся ниже
+        последнего, просто выбывает из списка.
+        """
+        scores = self._scores[window]
+        old = scores.get(pk, 0)
+        if score == old:
+            return
+        if score > 0:
+            scores[pk] = score
+        else:
+            scores.pop(pk, None)
+        entry = (-score, -pk)
+        for tag in (None, *self._tags.get(pk, ())):
+            key = (window, tag)
+            top = self._tops.setdefault(key, [])
+            position = bisect.bisect_left(top, (-old, -pk))
+            if top[position:position + 1] == [(-old, -pk)]:
+                del top[position]
+            if score > 0 and (key not in self._truncated
+                              or top and entry < top[-1]):
+                bisect.insort(top, entry)
+                if len(top) > 2 * POPULAR_TOP_SIZE:
+                    del top[-1]
+                    self._truncated.add(key)
+            elif key in self._truncated and len(top) < POPULAR_TOP_SIZE:
+                self._fill(key, (
+                    (-value, -recipe_id)
+                    for recipe_id, value in scores.items()
+                    if tag is None or tag in self._tags[recipe_id]))
+
+    def apply(self, recipe_ids, delta, day):
+        """Применяет изменение счётчиков рецептов за день."""
+        with self._lock:
+            if self._day is None:
+                return
+            self._load_tags(recipe_ids)
+            for window in POPULAR_WINDOWS:
+                if not (self._day - timedelta(days=window) < day
+                        <= self._day):
+                    continue
+                for pk in recipe_ids:
+                    self._set(window, pk,
+                              self._scores[window].get(pk, 0) + delta)
+
+    def retag(self, recipe_id, tag_ids):
+        """Переносит рецепт в списки его новых тегов."""
+        with self._lock:
+            if recipe_id not in self._tags:
+                return
+            scores = {window: self._scores[window].get(recipe_id, 0)
+                      for window in POPULAR_WINDOWS}
+            self.remove(recipe_id)
+            self._tags[recipe_id] = tuple(tag_ids)
+            for window, score in scores.items():
+                self._set(window, recipe_id, score)
+
+    def remove(self, recipe_id):
+        """Удаляет рецепт из рейтинга."""
+        with self._lock:
+            if self._day is None:
+                return
+            for window in POPULAR_WINDOWS:
+                self._set(window, recipe_id, 0)
+            self._tags.pop(recipe_id, None)
+
+    def top(self, window, tag_ids=(), limit=POPULAR_TOP_SIZE):
+        """
+        Первые limit пар (id рецепта, число добавлений) за окно.
+
+        С тегами объединяются списки этих тегов; при равном счёте
+        новые рецепты идут первыми.
+        """
+        with self._lock:
+            self._ensure_fresh()
+            lists = [self._tops.get((window, tag), [])
+                     for tag in (tag_ids or (None,))]
+            result, seen = [], set()
+            for score, pk in heapq.merge(*lists):
+                if pk in seen:
+                    continue
+                seen.add(pk)
+                result.append((-pk, -score))
+                if len(result) == limit:
+                    break
+            return result
+
+
+def track_favorites(favorites, delta):
+    """
+    Учитывает добавление (delta=1) или удаление (delta=-1) избранного.
+
+    favorites — пары (id рецепта, время добавления в избранное).
+    Дневные счётчики меняются в текущей транзакции, рейтинг процесса —
+    после её фиксации. Избранное старше самого длинного окна и без
+    времени добавления не учитывается.
+    """
+    cutoff = timezone.localdate() - timedelta(days=max(POPULAR_WINDOWS))
+    by_day = defaultdict(list)
+    for recipe_id, created_at in favorites:
+        if created_at is not None:
+            day = timezone.localdate(created_at)
+            if day > cutoff:
+                by_day[day].append(recipe_id)
+    for day, recipe_ids in by_day.items():
+        FavoriteDay.objects.change(recipe_ids, delta, day)
+        transaction.on_commit(
+            partial(popular_recipes.apply, recipe_ids, delta, day))
+
+
+popular_recipes = PopularRecipes()
@@ -0,0 +1,68 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+routing = ContextVar('replica_routing', default=None)
+
+
+class RoutingState:
+    """Состояние маршрутизации запросов к базе в рамках одного запроса."""
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+@contextmanager
+def use_primary():
+    """
+    Направляет чтение внутри блока в основную базу.
+
+    Используется при построении кэшей и индексов в памяти: их
+    перестраивают сразу после записи, и чтение с отстающей реплики
+    закэшировало бы прежние данные до конца срока жизни кэша.
+    Работает и как декоратор: @use_primary().
+    """
+    state = routing.get()
+    if state is None:
+        yield
+        return
+    use_replica, state.use_replica = state.use_replica, False
+    try:
+        yield
+    finally:
+        state.use_replica = use_replica and not state.wrote
+
+
+class ReplicaRouter:
+    """
+    Направляет чтение на реплики, а запись — в основную базу.
+
+    Реплики используются, только если ReplicaMiddleware разрешила это
+    для текущего запроса. После первой записи и внутри транзакции
+    основной базы чтение до конца запроса идёт в основную базу.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = routing.get()
+        if (state is None or not state.use_replica
+                or not settings.REPLICA_DATABASES
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.REPLICA_DATABASES)
+
+    def db_for_write(self, model, **hints):
+        state = routing.get()
+        if state is not None:
+            state.use_replica = False
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
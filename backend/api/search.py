@@ -0,0 +1,363 @@
+import bisect
+import logging
+import threading
+import time
+from array import array
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import DatabaseError, connections
+
+from module.constants import (
+    INGREDIENT_INDEX_TTL, NGRAM_SIZE, RECIPE_INDEX_TTL, RECIPE_MATCH_LIMIT
+)
+from recipes.models import Ingredient, RecipeIngredient
+from .popular import popular_recipes
+from .replicas import use_primary
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(value):
+    """Приводит строку к виду для поиска без учёта регистра."""
+    return value.casefold().replace('ё', 'е').strip()
+
+
+def ngrams(value):
+    """Множество n-грамм строки."""
+    return {value[i:i + NGRAM_SIZE]
+            for i in range(len(value) - NGRAM_SIZE + 1)}
+
+
+class IngredientIndex:
+    """
+    Поисковый индекс ингредиентов в памяти процесса.
+
+    Префиксный поиск выполняется бинарным поиском по отсортированному
+    списку имён, поиск по вхождению — по индексу n-грамм. Совпадения
+    по началу имени возвращаются раньше совпадений внутри имени.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._rows = {}
+        self._keys = []
+        self._ngrams = defaultdict(set)
+
+    @use_primary()
+    def build(self):
+        """Полностью перестраивает индекс по таблице ингредиентов."""
+        rows = {}
+        keys = []
+        index = defaultdict(set)
+        for row in Ingredient.objects.values(
+                'id', 'name', 'measurement_unit').iterator():
+            key = normalize(row['name'])
+            rows[row['id']] = (key, row)
+            keys.append((key, row['id']))
+            for gram in ngrams(key):
+                index[gram].add(row['id'])
+        keys.sort()
+        with self._lock:
+            self._rows, self._keys, self._ngrams = rows, keys, index
+            self._built_at = time.monotonic()
+
+    @property
+    def fresh(self):
+        """Индекс построен и не устарел; поиск не обратится к базе."""
+        return (self._built_at is not None
+                and time.monotonic() - self._built_at <= INGREDIENT_INDEX_TTL)
+
+    def _ensure_built(self):
+        if not self.fresh:
+            self.build()
+
+    def add(self, ingredient):
+        """Добавляет или обновляет ингредиент в индексе."""
+        with self._lock:
+            if self._built_at is None:
+                return
+            self.remove(ingredient.pk)
+            key = normalize(ingredient.name)
+            row = {
+                'id': ingredient.pk,
+                'name': ingredient.name,
+                'measurement_unit': ingredient.measurement_unit,
+            }
+            self._rows[ingredient.pk] = (key, row)
+            bisect.insort(self._keys, (key, ingredient.pk))
+            for gram in ngrams(key):
+                self._ngrams[gram].add(ingredient.pk)
+
+    def remove(self, pk):
+        """Удаляет ингредиент из индекса."""
+        with self._lock:
+            key, _ = self._rows.pop(pk, (None, None))
+            if key is None:
+                return
+            position = bisect.bisect_left(self._keys, (key, pk))
+            if self._keys[position:position + 1] == [(key, pk)]:
+                del self._keys[position]
+            for gram in ngrams(key):
+                self._ngrams[gram].discard(pk)
+
+    def search(self, query, limit=None):
+        """
+        Ищет ингредиенты по началу имени и по вхождению.
+
+        Сначала возвращаются совпадения по префиксу, затем — по вхождению,
+        каждая группа отсортирована по имени.
+        """
+        query = normalize(query)
+        with self._lock:
+            self._ensure_built()
+            result = []
+            position = bisect.bisect_left(self._keys, (query,))
+            for key, pk in self._keys[position:]:
+                if not key.startswith(query) or len(result) == limit:
+                    break
+                result.append(pk)
+            if limit is None or len(result) < limit:
+                result.extend(self._infix(query, set(result), limit))
+            return [self._rows[pk][1] for pk in result[:limit]]
+
+    def _infix(self, query, exclude, limit):
+        grams = ngrams(query)
+        if grams:
+            candidates = set.intersection(
+                *(self._ngrams.get(gram, set()) for gram in grams))
+        else:
+            candidates = self._rows.keys()
+        matches = sorted(
+            (self._rows[pk][0], pk) for pk in candidates
+            if pk not in exclude and query in self._rows[pk][0]
+        )
+        return [pk for _, pk in matches]
+
+
+def to_bitmap(ids):
+    """Битовая карта (целое число) из отсортированных идентификаторов."""
+    if not ids:
+        return 0
+    data = bytearray(ids[-1] // 8 + 1)
+    for pk in ids:
+        data[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(data, 'little')
+
+
+class RecipeIngredientIndex:
+    """
+    Обратный индекс «ингредиент → рецепты» в памяти процесса.
+
+    Рецепты ингредиента хранятся битовой картой — целым числом, в котором
+    бит с номером id рецепта установлен, — если она не больше
+    отсортированного массива идентификаторов, иначе массивом. Совпадения
+    с набором ингредиентов считаются сложением карт по разрядам
+    (bit-sliced), поэтому стоимость запроса зависит от числа ингредиентов
+    в запросе, а не от числа рецептов в каждом из них.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._built_at = None
+        self._replay = None
+        self._postings = {}
+        self._counts = array('H')
+        self._sizes = {}
+
+    def build(self):
+        """
+        Полностью перестраивает индекс по ингредиентам рецептов.
+
+        Индекс строится без блокировки, поиск в это время идёт по
+        прежнему. Изменения рецептов, пришедшие во время построения,
+        применяются к новому индексу повторно после замены.
+        """
+        with self._build_lock:
+            self._build()
+
+    def refresh(self):
+        """Перестраивает индекс в фоновом потоке, если он ещё не строится."""
+        if not self._build_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self._build()
+        except DatabaseError:
+            logger.exception('Не удалось перестроить индекс рецептов')
+        finally:
+            self._build_lock.release()
+            connections.close_all()
+
+    @use_primary()
+    def _build(self):
+        with self._lock:
+            self._replay = []
+        try:
+            postings = defaultdict(lambda: array('I'))
+            counts = array('H')
+            for recipe_id, ingredient_id in RecipeIngredient.objects.order_by(
+                    'recipe_id').values_list(
+                        'recipe_id', 'ingredient_id').iterator():
+                postings[ingredient_id].append(recipe_id)
+                if recipe_id >= len(counts):
+                    counts.extend(bytes(2 * (recipe_id + 1 - len(counts))))
+                counts[recipe_id] += 1
+            sizes = defaultdict(list)
+            for recipe_id, count in enumerate(counts):
+                if count:
+                    sizes[count].append(recipe_id)
+            postings = {
+                pk: self._compact(ids, len(counts))
+                for pk, ids in postings.items()}
+            sizes = {count: to_bitmap(ids) for count, ids in sizes.items()}
+        except BaseException:
+            with self._lock:
+                self._replay = None
+            raise
+        with self._lock:
+            self._postings, self._counts, self._sizes = (
+                postings, counts, sizes)
+            self._built_at = time.monotonic()
+            for recipe_id, ingredient_ids in self._replay:
+                self._update(recipe_id, ingredient_ids)
+            self._replay = None
+
+    @staticmethod
+    def _compact(ids, universe):
+        """Карта, если она не больше массива из 4-байтовых чисел."""
+        return to_bitmap(ids) if len(ids) * 32 >= universe else ids
+
+    @property
+    def fresh(self):
+        """Индекс построен и не устарел."""
+        return (self._built_at is not None
+                and time.monotonic() - self._built_at <= RECIPE_INDEX_TTL)
+
+    def update(self, recipe_id, ingredient_ids):
+        """Заменяет ингредиенты рецепта в индексе."""
+        ingredient_ids = set(ingredient_ids)
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((recipe_id, ingredient_ids))
+            if self._built_at is not None:
+                self._update(recipe_id, ingredient_ids)
+
+    def remove(self, recipe_id):
+        """Удаляет рецепт из индекса."""
+        self.update(recipe_id, ())
+
+    def _update(self, recipe_id, ingredient_ids):
+        self._remove(recipe_id)
+        if not ingredient_ids:
+            return
+        if recipe_id >= len(self._counts):
+            self._counts.extend(
+                bytes(2 * (recipe_id + 1 - len(self._counts))))
+        count = len(ingredient_ids)
+        self._counts[recipe_id] = count
+        self._sizes[count] = self._sizes.get(count, 0) | 1 << recipe_id
+        for pk in ingredient_ids:
+            posting = self._postings.setdefault(pk, array('I'))
+            if isinstance(posting, int):
+                self._postings[pk] = posting | 1 << recipe_id
+            else:
+                bisect.insort(posting, recipe_id)
+
+    def _remove(self, recipe_id):
+        if recipe_id >= len(self._counts):
+            return
+        count = self._counts[recipe_id]
+        if not count:
+            return
+        self._counts[recipe_id] = 0
+        self._sizes[count] &= ~(1 << recipe_id)
+        for pk, posting in self._postings.items():
+            if isinstance(posting, int):
+                if not posting >> recipe_id & 1:
+                    continue
+                self._postings[pk] = posting ^ 1 << recipe_id
+            else:
+                position = bisect.bisect_left(posting, recipe_id)
+                if (position == len(posting)
+                        or posting[position] != recipe_id):
+                    continue
+                del posting[position]
+            count -= 1
+            if not count:
+                break
+
+    def match(self, ingredient_ids, limit=RECIPE_MATCH_LIMIT):
+        """
+        Рецепты, лучше всего покрытые набором ингредиентов.
+
+        Покрытие — доля ингредиентов рецепта, входящих в набор. Возвращает
+        до limit пар (id рецепта, покрытие) по убыванию покрытия, при
+        равном покрытии — сначала с большим числом совпадений и новые.
+        Устаревший индекс обслуживает запросы, пока новый строится в фоне.
+        """
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self._build()
+        elif not self.fresh:
+            self.refresh()
+        with self._lock:
+            bitmaps = [
+                posting if isinstance(posting, int) else to_bitmap(posting)
+                for posting in (self._postings.get(pk)
+                                for pk in set(ingredient_ids))
+                if posting
+            ]
+            if not bitmaps:
+                return []
+            candidates = reduce(or_, bitmaps)
+            planes = []
+            for carry in bitmaps:
+                for position, plane in enumerate(planes):
+                    if not carry:
+                        break
+                    planes[position], carry = plane ^ carry, plane & carry
+                if carry:
+                    planes.append(carry)
+            hits = {}
+            for count in range(1, 1 << len(planes)):
+                selected = candidates
+                for position, plane in enumerate(planes):
+                    selected &= (plane if count >> position & 1
+                                 else candidates ^ plane)
+                if selected:
+                    hits[count] = selected
+            result = []
+            for count, size in sorted(
+                    ((count, size) for count in hits for size in self._sizes
+                     if size >= count),
+                    key=lambda pair: (-pair[0] / pair[1], -pair[0])):
+                selected = hits[count] & self._sizes[size]
+                while selected and len(result) < limit:
+                    recipe_id = selected.bit_length() - 1
+                    result.append((recipe_id, count / size))
+                    selected ^= 1 << recipe_id
+                if len(result) == limit:
+                    break
+            return result
+
+
+def warm_up():
+    """Строит индексы и рейтинг заранее, чтобы первые запросы их не ждали."""
+    try:
+        for index in (ingredient_index, recipe_index, popular_recipes):
+            index.build()
+    except DatabaseError:
+        logger.exception('Не удалось построить поисковые индексы')
+    finally:
+        connections.close_all()
+
+
+ingredient_index = IngredientIndex()
+recipe_index = RecipeIngredientIndex()
@@ -1,32 +1,62 @@
 import base64
 
-from django.db.models import F
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import (
+    Manager, Prefetch, Value, prefetch_related_objects
+)
 from django.core.files.base import ContentFile
 from djoser.serializers import UserSerializer
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
+from module.constants import BATCH_MAX_SIZE, IMAGE_MAX_UPLOAD_SIZE
+from recipes import images, jobs
 from recipes.models import (
-    Favorite, Ingredient, Recipe, RecipeIngredient,
+    Favorite, Ingredient, Job, Recipe, RecipeIngredient,
     ShoppingCart, Subscription, Tag
 )
+from .middleware import phase
+from .popular import track_favorites
 
 User = get_user_model()
 
 
+class InstrumentedSerializerMixin:
+    """Учитывает время представления объектов в фазе serialize."""
+
+    def to_representation(self, instance):
+        with phase('serialize'):
+            return super().to_representation(instance)
+
+
 class Base64ImageField(serializers.ImageField):
-    """Поле сериализатора для обработки изображений в формате base64."""
+    """
+    Поле сериализатора для обработки изображений в формате base64.
+
+    Размер декодированных данных проверяется по длине строки до
+    декодирования, изображение перекодируется без метаданных.
+    """
+    default_error_messages = {
+        'too_large': 'Размер изображения не должен превышать {max_size} байт.',
+    }
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
+            decoded_size = len(imgstr) * 3 // 4 - imgstr.count('=', -2)
+            if decoded_size > IMAGE_MAX_UPLOAD_SIZE:
+                self.fail('too_large', max_size=IMAGE_MAX_UPLOAD_SIZE)
             data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+        image = super().to_internal_value(data)
+        try:
+            return images.sanitize(image)
+        except (OSError, ValueError):
+            self.fail('invalid_image')
 
 
-class AuthorSerializer(UserSerializer):
+class AuthorSerializer(InstrumentedSerializerMixin, UserSerializer):
     """Сериализатор для пользователя."""
     is_subscribed = serializers.SerializerMethodField()
 
@@ -35,43 +65,48 @@ class AuthorSerializer(UserSerializer):
         fields = ('id', 'email', *User.REQUIRED_FIELDS, 'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         request = self.context.get('request')
         return bool(
             request
             and request.user.is_authenticated
-            and obj.subscriptions.exists()
+            and request.user.subscriptions.filter(subcripe=obj).exists()
         )
 
 
-class SubscriptionsSerializer(serializers.ModelSerializer):
+class SubscriptionsSerializer(AuthorSerializer):
+    """
+    Сериализатор автора в подписках текущего пользователя.
+
+    Ожидает авторов, аннотированных recipes_count, с заранее загруженными
+    рецептами (см. prefetch_recipes).
+    """
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
-    class Meta:
-        model = Subscription
-        fields = ['subcripe', 'recipes', 'recipes_count']
+    class Meta(AuthorSerializer.Meta):
+        fields = (*AuthorSerializer.Meta.fields, 'recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
+        return RecipeShortSerializer(
+            obj.recipes.all(), many=True, context=self.context).data
+
+    @staticmethod
+    def prefetch_recipes(authors, request):
+        """
+        Загружает рецепты страницы авторов одним запросом.
+
+        При переданном recipes_limit для каждого автора выбираются только
+        первые recipes_limit рецептов.
+        """
+        recipes = Recipe.objects.filter(author__in=authors)
         recipes_limit = request.query_params.get('recipes_limit')
-        recipes_list = obj.subcripe.recipes.all()
         if recipes_limit and recipes_limit.isdigit():
-            recipes_list = recipes_list[:int(recipes_limit)]
-
-        return recipes_list
-
-    def get_recipes_count(self, obj):
-        return self.get_recipes(obj).count()
-
-    def to_representation(self, instance):
-        representation = dict(AuthorSerializer(
-            instance.subcripe,
-            context={'request': self.context.get('request')}).data
-        )
-        representation['recipes'] = RecipeShortSerializer(
-            self.get_recipes(instance), many=True).data
-        representation['recipes_count'] = self.get_recipes_count(instance)
-        return representation
+            recipes = recipes.first_per_author(int(recipes_limit))
+        prefetch_related_objects(authors, Prefetch('recipes', recipes))
+        return authors
 
 
 class SubscripeSerializer(serializers.ModelSerializer):
@@ -103,11 +138,16 @@ class SubscripeSerializer(serializers.ModelSerializer):
         return subcripe
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        author = User.objects.with_recipes_count().annotate(
+            is_subscribed=Value(True)).get(pk=instance.subcripe_id)
+        SubscriptionsSerializer.prefetch_recipes([author], request)
         return SubscriptionsSerializer(
-            instance, context={'request': self.context.get('request')}).data
+            author, context={'request': request}).data
 
 
-class IngredientReadSerializer(serializers.ModelSerializer):
+class IngredientReadSerializer(InstrumentedSerializerMixin,
+                               serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
@@ -123,52 +163,139 @@ class IngredientWriteSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор тега."""
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug')
 
 
-class RecipeShortSerializer(serializers.ModelSerializer):
+class RecipeImagesMixin(InstrumentedSerializerMixin, serializers.Serializer):
+    """Ссылки на варианты изображения рецепта."""
+    images = serializers.SerializerMethodField()
+
+    def get_images(self, obj):
+        if not obj.renditions_ready:
+            return None
+        return self.absolute_urls(images.rendition_urls(obj.image))
+
+    def absolute_urls(self, urls):
+        """Абсолютные URL вариантов, если в контексте есть запрос."""
+        request = self.context.get('request')
+        if not urls or request is None:
+            return urls
+        return {
+            rendition: {extension: request.build_absolute_uri(url)
+                        for extension, url in formats.items()}
+            for rendition, formats in urls.items()
+        }
+
+
+class RecipeShortSerializer(RecipeImagesMixin, serializers.ModelSerializer):
     """Краткий сериализатор рецепта."""
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
+
+
+class RecipeIngredientReadSerializer(serializers.ModelSerializer):
+    """Сериализатор ингредиента рецепта с количеством."""
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit')
+
+    class Meta:
+        model = RecipeIngredient
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class AuthorSummarySerializer(serializers.ModelSerializer):
+    """Автор рецепта без данных, зависящих от пользователя."""
+
+    class Meta:
+        model = User
+        fields = ('id', 'email', *User.REQUIRED_FIELDS)
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeDocumentSerializer(RecipeImagesMixin, serializers.ModelSerializer):
+    """
+    Документ рецепта для хранения в поле document.
+
+    Содержит всё, что не зависит от пользователя и счётчиков:
+    теги, ингредиенты с количеством, автора и ссылки на изображения.
+    Ожидает queryset, подготовленный Recipe.objects.with_relations.
+    """
     tags = TagSerializer(many=True)
-    ingredients = serializers.SerializerMethodField()
-    author = AuthorSerializer(required=False)
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    ingredients = RecipeIngredientReadSerializer(
+        source='recipeingredient_set', many=True)
+    author = AuthorSummarySerializer()
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        fields = ('id', 'tags', 'author', 'ingredients', 'name', 'image',
+                  'images', 'text', 'cooking_time')
 
-    def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        return bool(
-            request
-            and request.user.is_authenticated
-            and obj.favorites.exists()
-        )
 
-    def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        return bool(
-            request
-            and request.user.is_authenticated
-            and obj.shopcarts.exists()
-        )
+class RecipeReadListSerializer(serializers.ListSerializer):
+    """
+    Список рецептов для чтения.
+
+    Рецепты без готового документа сериализуются по связанным таблицам,
+    поэтому их связи загружаются заранее, по запросу на связь для всей
+    страницы.
+    """
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        Recipe.objects.prefetch_relations(
+            [recipe for recipe in recipes if recipe.document is None])
+        return super().to_representation(recipes)
+
 
-    def get_ingredients(self, obj):
-        ingredients = obj.ingredients.values(
-            'id', 'name', 'measurement_unit',
-            amount=F('recipeingredient__amount'))
-        return ingredients
+class RecipeReadSerializer(RecipeImagesMixin, serializers.ModelSerializer):
+    """
+    Сериализатор чтения рецепта.
+
+    Ожидает queryset, подготовленный Recipe.objects.with_viewer_flags:
+    флаги пользователя читаются из аннотаций, счётчики — из полей
+    рецепта, остальное — из готового документа. Рецепт без документа
+    (до его построения) сериализуется по связанным таблицам.
+    """
+    tags = TagSerializer(many=True)
+    ingredients = RecipeIngredientReadSerializer(
+        source='recipeingredient_set', many=True)
+    author = AuthorSerializer(required=False)
+    is_favorited = serializers.BooleanField(read_only=True)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = Recipe
+        exclude = ('search_vector', 'document', 'renditions_ready')
+        list_serializer_class = RecipeReadListSerializer
+
+    def to_representation(self, instance):
+        if instance.document is None:
+            instance.author.is_subscribed = instance.author_is_subscribed
+            return super().to_representation(instance)
+        with phase('serialize'):
+            document = instance.document
+            image = document['image']
+            request = self.context.get('request')
+            if image and request is not None:
+                image = request.build_absolute_uri(image)
+            data = {
+                **document,
+                'image': image,
+                'images': self.absolute_urls(document['images']),
+                'author': {**document['author'],
+                           'is_subscribed': instance.author_is_subscribed},
+                'is_favorited': instance.is_favorited,
+                'is_in_shopping_cart': instance.is_in_shopping_cart,
+                'favorites_count': instance.favorites_count,
+                'in_carts_count': instance.in_carts_count,
+            }
+            return {name: data[name] for name in self.fields}
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
@@ -216,6 +343,37 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             for ingredient in ingredients
         )
 
+    @staticmethod
+    def ingredient_sync(recipe, ingredients):
+        """
+        Приводит ингредиенты рецепта к переданному списку.
+
+        Изменяются только отличающиеся строки: новые добавляются,
+        изменённые количества обновляются, лишние удаляются.
+        """
+        existing = {
+            item.ingredient_id: item
+            for item in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        submitted = {
+            ingredient['id'].pk: ingredient for ingredient in ingredients}
+
+        RecipeIngredient.objects.filter(
+            pk__in=[existing[pk].pk for pk in existing.keys() - submitted]
+        ).delete()
+        changed = []
+        for pk in existing.keys() & submitted:
+            item = existing[pk]
+            if item.amount != submitted[pk]['amount']:
+                item.amount = submitted[pk]['amount']
+                changed.append(item)
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        RecipeCreateSerializer.ingredient_bulk_create(
+            recipe,
+            [submitted[pk] for pk in submitted.keys() - existing.keys()]
+        )
+
+    @transaction.atomic
     def create(self, validated_data):
         """Создание нового рецепта."""
         tags = validated_data.pop('tags', [])
@@ -224,29 +382,47 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         recipe.tags.set(tags)
 
         self.ingredient_bulk_create(recipe=recipe, ingredients=ingredients)
+        jobs.enqueue('create_renditions', user=recipe.author,
+                     recipe_id=recipe.pk)
+        jobs.enqueue('fan_out_recipe', user=recipe.author,
+                     recipe_id=recipe.pk)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        """Обновление существующего рецепта."""
-        ingredients = validated_data.pop('ingredients', [])
-        tags = validated_data.pop('tags', [])
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.ingredient_bulk_create(
-            recipe=instance,
-            ingredients=ingredients
-        )
-
-        return super().update(instance, validated_data)
+        """
+        Обновление существующего рецепта.
+
+        Рецепт блокируется до конца транзакции, поэтому параллельные
+        изменения не смешиваются.
+        """
+        instance = Recipe.objects.select_for_update().get(pk=instance.pk)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            self.ingredient_sync(instance, ingredients)
+
+        if 'image' in validated_data:
+            validated_data['renditions_ready'] = False
+        instance = super().update(instance, validated_data)
+        if 'image' in validated_data:
+            jobs.enqueue('create_renditions', user=instance.author,
+                         recipe_id=instance.pk)
+        return instance
 
     def to_representation(self, instance):
         """Преобразование объекта в представление."""
+        request = self.context.get('request')
+        instance = Recipe.objects.with_viewer_flags(
+            request.user).get(pk=instance.pk)
         return RecipeReadSerializer(
-            instance, context={'request': self.context.get('request')}).data
+            instance, context={'request': request}).data
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
-    """Сериализатор для избранного."""
+class RecipeRelationSerializer(serializers.ModelSerializer):
+    """Основа сериализаторов связи пользователя с рецептом."""
     author = serializers.HiddenField(
         default=serializers.CurrentUserDefault()
     )
@@ -256,9 +432,31 @@ class FavoriteSerializer(serializers.ModelSerializer):
     )
 
     class Meta:
-        model = Favorite
         fields = ('author', 'recipe')
         read_only_fields = ('id', 'author', 'recipe')
+
+    @transaction.atomic
+    def create(self, validated_data):
+        """Создаёт связь и увеличивает счётчик рецепта."""
+        instance = super().create(validated_data)
+        Recipe.objects.filter(pk=instance.recipe_id).change_counter(
+            self.Meta.model.counter_field, 1)
+        self.after_create(instance)
+        return instance
+
+    def after_create(self, instance):
+        """Действия после создания связи в той же транзакции."""
+
+    def to_representation(self, instance):
+        return RecipeShortSerializer(
+            instance.recipe, context=self.context).data
+
+
+class FavoriteSerializer(RecipeRelationSerializer):
+    """Сериализатор для избранного."""
+
+    class Meta(RecipeRelationSerializer.Meta):
+        model = Favorite
         validators = [
             UniqueTogetherValidator(
                 queryset=Favorite.objects.all(),
@@ -267,14 +465,15 @@ class FavoriteSerializer(serializers.ModelSerializer):
             )
         ]
 
-    def to_representation(self, instance):
-        return RecipeShortSerializer(instance.recipe).data
+    def after_create(self, instance):
+        """Учитывает добавление в рейтинге популярных рецептов."""
+        track_favorites([(instance.recipe_id, instance.created_at)], 1)
 
 
-class ShoppingCartSerializer(FavoriteSerializer):
+class ShoppingCartSerializer(RecipeRelationSerializer):
     """Сериализатор для покупки."""
 
-    class Meta(FavoriteSerializer.Meta):
+    class Meta(RecipeRelationSerializer.Meta):
         model = ShoppingCart
         validators = [
             UniqueTogetherValidator(
@@ -283,3 +482,21 @@ class ShoppingCartSerializer(FavoriteSerializer):
                 message='Рецепт уже есть в список покупок.'
             )
         ]
+
+
+class JobSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    """Сериализатор статуса фоновой задачи."""
+
+    class Meta:
+        model = Job
+        fields = ('id', 'name', 'status', 'attempts', 'result',
+                  'created_at', 'updated_at')
+
+
+class BatchIdsSerializer(serializers.Serializer):
+    """Список идентификаторов для пакетных операций."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_MAX_SIZE
+    )
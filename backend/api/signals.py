@@ -0,0 +1,117 @@
+from django.contrib.auth import get_user_model
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete
+)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes import jobs
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from .authentication import invalidate_tokens
+from .cache import reference_cache, tag_slugs
+from .documents import recipe_documents
+from .middleware import execute_wrapper
+from .popular import popular_recipes
+from .search import ingredient_index, recipe_index
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_index(sender, instance, **kwargs):
+    """Обновляет поисковый индекс при сохранении ингредиента."""
+    ingredient_index.add(instance)
+
+
+@receiver(post_delete, sender=Ingredient)
+def remove_from_ingredient_index(sender, instance, **kwargs):
+    """Удаляет ингредиент из поискового индекса."""
+    ingredient_index.remove(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_reference_cache(sender, **kwargs):
+    """Сбрасывает кэш ответов справочника при его изменении."""
+    reference_cache.invalidate(sender._meta.label_lower)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tag_slugs(sender, **kwargs):
+    """Сбрасывает отображение slug тегов при их изменении."""
+    tag_slugs.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def rebuild_recipe_document(sender, instance, **kwargs):
+    """Перестраивает документ сохранённого рецепта."""
+    recipe_documents.schedule([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_recipe_index(sender, instance, **kwargs):
+    """Удаляет рецепт из индекса ингредиентов и рейтинга популярных."""
+    recipe_index.remove(instance.pk)
+    popular_recipes.remove(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def rebuild_recipe_ingredients(sender, instance, **kwargs):
+    """Перестраивает документ рецепта при изменении его ингредиентов."""
+    recipe_documents.schedule([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def rebuild_recipe_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """Перестраивает документы рецептов при изменении их тегов."""
+    if not reverse:
+        if action.startswith('post_'):
+            recipe_documents.schedule([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        recipe_documents.schedule(pk_set)
+    elif action == 'pre_clear':
+        recipe_documents.schedule(
+            instance.recipes.values_list('pk', flat=True))
+
+
+@receiver([post_save, pre_delete], sender=Ingredient)
+@receiver([post_save, pre_delete], sender=Tag)
+def rebuild_reference_documents(sender, instance, **kwargs):
+    """
+    Перестраивает документы рецептов с изменённым тегом или ингредиентом.
+
+    При удалении рецепты выбираются до удаления связей.
+    """
+    lookup = 'tags' if sender is Tag else 'ingredients'
+    recipe_documents.schedule(Recipe.objects.filter(
+        **{lookup: instance}).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Сбрасывает кэш удалённого токена, в том числе при выходе."""
+    invalidate_tokens(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def rebuild_author_documents(sender, instance, created, update_fields=None,
+                             **kwargs):
+    """
+    Ставит в очередь перестроение документов рецептов автора
+    при изменении его данных.
+
+    Рецептов у автора может быть много, поэтому документы строятся
+    фоновой задачей, а не в запросе, изменившем профиль.
+    """
+    if created or (update_fields is not None
+                   and set(update_fields) <= {'last_login'}):
+        return
+    if instance.recipes.exists():
+        jobs.enqueue('rebuild_author_documents', user=instance,
+                     author_id=instance.pk)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Подключает замеры SQL к новому соединению с базой."""
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
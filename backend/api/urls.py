@@ -1,18 +1,27 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .async_views import urlpatterns as async_urlpatterns
 from .views import (
-    FoodUserViewSet, IngredientViewSet, RecipeViewSet, TagViewSet)
+    FoodUserViewSet, IngredientViewSet, JobViewSet, RecipeViewSet, TagViewSet,
+    metrics
+)
 
 router_v1 = DefaultRouter()
 router_v1.register('users', FoodUserViewSet, basename='user')
 router_v1.register('tags', TagViewSet, basename='tag')
 router_v1.register('recipes', RecipeViewSet, basename='recipe')
 router_v1.register('ingredients', IngredientViewSet, basename='ingredient')
+router_v1.register('jobs', JobViewSet, basename='job')
 
 
 urlpatterns = [
+    path('metrics', metrics, name='metrics'),
     path('', include(router_v1.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+if settings.SERVER_MODE == 'asgi':
+    urlpatterns = async_urlpatterns + urlpatterns
@@ -1,29 +1,55 @@
-from django.db.models import F
+from django.db.models import Exists, OuterRef, Value
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from djoser.views import UserViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, permissions, status, validators, viewsets
-from rest_framework.decorators import action
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.decorators import (
+    action, api_view, permission_classes
+)
 from rest_framework.response import Response
 
 from . import mixins, serializers
-from .filters import RecipeFilterSet, IngredientFilterSet
-from .paginations import PageLimitPagination
-from .permissions import IsAdminOrReadOnly, IsAuthorOrReadOnly
+from .cache import tag_slugs
+from .filters import RecipeFilterSet
+from .metrics import registry
+from .paginations import (
+    KeysetPagination, LimitOffsetKeysetPagination, PageLimitPagination
+)
+from .permissions import (
+    IsAdminOrReadOnly, IsAuthorOrReadOnly, IsStaffOrMetricsToken
+)
+from .popular import popular_recipes, track_favorites
+from .search import ingredient_index, recipe_index
 from module import scripts
-from recipes.models import Ingredient, Recipe, Tag
+from module.constants import (
+    POPULAR_LIMIT, POPULAR_TOP_SIZE, POPULAR_WINDOWS, RECIPE_MATCH_LIMIT,
+    RECIPE_MATCH_MAX_LIMIT, SHOPPING_CART_FILENAME
+)
+from recipes import jobs
+from recipes.models import (
+    Favorite, FeedEntry, Ingredient, Job, Recipe, RecipeIngredient,
+    ShoppingCart, Subscription, Tag
+)
 
 
 User = get_user_model()
 
 
-class FoodUserViewSet(UserViewSet):
+class FoodUserViewSet(mixins.BatchRelationMixin, UserViewSet):
     """ViewSet для управления пользователями."""
     queryset = User.objects.all()
     serializer_class = serializers.AuthorSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = LimitOffsetKeysetPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if self.action in ('list', 'retrieve') and user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                user.subscriptions.filter(subcripe=OuterRef('pk'))))
+        return queryset
 
     def get_permissions(self):
         if self.action in ['retrieve', 'list']:
@@ -41,6 +67,9 @@ class FoodUserViewSet(UserViewSet):
         elif self.action == 'subscriptions':
             return serializers.SubscriptionsSerializer(
                 *args, **kwargs, context=context)
+        elif self.action == 'feed':
+            return serializers.RecipeReadSerializer(
+                *args, **kwargs, context=context)
         return super().get_serializer(*args, **kwargs)
 
     @action(methods=['post'],
@@ -50,40 +79,95 @@ class FoodUserViewSet(UserViewSet):
         serializer = self.get_serializer(
             data={'subcripe': self.get_object().id})
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        with transaction.atomic():
+            subscription = serializer.save()
+            FeedEntry.objects.backfill(
+                request.user, [subscription.subcripe_id])
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
+    @transaction.atomic
     def subscribe_destroy(self, request, *args, **kwargs):
+        author = self.get_object()
         instance, _ = request.user.subscriptions.filter(
-            subcripe=self.get_object()
-        ).delete()
+            subcripe=author).delete()
         if not instance:
             raise validators.ValidationError(
                 {'errors': 'Этот пользватель не добавлен в подписку.'})
+        FeedEntry.objects.prune(request.user, [author.pk])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(methods=['get'], detail=False)
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='subscribe',
+            permission_classes=[permissions.IsAuthenticated])
+    def subscribe_batch(self, request, *args, **kwargs):
+        """Пакетная подписка на авторов и отписка от них."""
+        return self.perform_batch_response(
+            Subscription, 'subcripe_id',
+            User.objects.exclude(pk=request.user.pk), self.update_feed)
+
+    def update_feed(self, author_ids, delta):
+        """Дополняет или очищает ленту при изменении подписок."""
+        if delta > 0:
+            FeedEntry.objects.backfill(self.request.user, author_ids)
+        else:
+            FeedEntry.objects.prune(self.request.user, author_ids)
+
+    @action(methods=['get'],
+            detail=False,
+            permission_classes=[permissions.IsAuthenticated])
     def subscriptions(self, request, *args, **kwargs):
         """Получение списка подписок пользователя."""
-        paginator = self.pagination_class()
+        queryset = User.objects.filter(
+            subscription__author=request.user
+        ).with_recipes_count().annotate(is_subscribed=Value(True))
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(
+            serializers.SubscriptionsSerializer.prefetch_recipes(
+                page, request),
+            many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['get'],
+            detail=False,
+            pagination_class=KeysetPagination,
+            permission_classes=[permissions.IsAuthenticated])
+    def feed(self, request, *args, **kwargs):
+        """
+        Лента рецептов авторов из подписок, новые первыми.
+
+        Страница выбирается курсором по ленте пользователя, рецепты
+        страницы загружаются вторым запросом по идентификаторам.
+        """
+        entries = self.paginate_queryset(
+            FeedEntry.objects.filter(user=request.user))
+        recipes = Recipe.objects.with_viewer_flags(request.user).in_bulk(
+            [entry.recipe_id for entry in entries])
         serializer = self.get_serializer(
-            paginator.paginate_queryset(request.user.subscriptions.all(),
-                                        request), many=True)
-        return paginator.get_paginated_response(serializer.data)
+            [recipes[entry.recipe_id] for entry in entries
+             if entry.recipe_id in recipes],
+            many=True)
+        return self.get_paginated_response(serializer.data)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(mixins.BatchRelationMixin, viewsets.ModelViewSet):
     """ViewSet для управления рецептами."""
-    queryset = Recipe.objects.prefetch_related('tags', 'ingredients').all()
+    queryset = Recipe.objects.all()
     serializer_class = serializers.RecipeCreateSerializer
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_class = RecipeFilterSet
+    ordering_fields = ('name', 'favorites_count', 'in_carts_count')
     pagination_class = PageLimitPagination
     permission_classes = [IsAuthorOrReadOnly | IsAdminOrReadOnly]
 
-    def get_serializer(self, *args, **kwargs):
+    def get_queryset(self):
         if self.action in ('list', 'retrieve'):
+            return self.queryset.with_viewer_flags(self.request.user)
+        return super().get_queryset()
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in ('list', 'retrieve', 'cookable', 'popular'):
             return serializers.RecipeReadSerializer(
                 *args, **kwargs, context={'request': self.request})
         elif self.action == 'shopping_cart':
@@ -100,13 +184,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @shopping_cart.mapping.delete
     def destroy_shopping_cart(self, request, *args, **kwargs):
-        instance, _ = request.user.shopcarts.filter(
-            recipe=self.get_object()
-        ).delete()
-        if not instance:
-            raise validators.ValidationError(
-                {'errors': 'Этот рецепт не добавлен в список покупок'})
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.perform_destroy_response(
+            request.user.shopcarts,
+            'Этот рецепт не добавлен в список покупок')
 
     @action(methods=['post'],
             detail=True,
@@ -116,33 +196,138 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @favorite.mapping.delete
     def destroy_favorite(self, request, *args, **kwargs):
-        instance, _ = request.user.favorites.filter(
-            recipe=self.get_object()
-        ).delete()
-        if not instance:
-            raise validators.ValidationError(
-                {'errors': 'Этот рецепт не добавлен в избранный'})
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.perform_destroy_response(
+            request.user.favorites, 'Этот рецепт не добавлен в избранный',
+            lambda favorites: track_favorites(
+                favorites.values_list('recipe_id', 'created_at'), -1))
+
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='shopping_cart',
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_cart_batch(self, request, *args, **kwargs):
+        """Пакетное добавление рецептов в список покупок и удаление."""
+        return self.perform_batch_response(
+            ShoppingCart, 'recipe_id', Recipe.objects.all(),
+            self.change_counters(ShoppingCart))
+
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='favorite',
+            permission_classes=[permissions.IsAuthenticated])
+    def favorite_batch(self, request, *args, **kwargs):
+        """Пакетное добавление рецептов в избранное и удаление."""
+        return self.perform_batch_response(
+            Favorite, 'recipe_id', Recipe.objects.all(),
+            self.change_favorites)
+
+    @staticmethod
+    def change_counters(model):
+        """Обработчик изменения связей, обновляющий счётчики рецептов."""
+        def on_change(recipe_ids, delta):
+            Recipe.objects.filter(pk__in=recipe_ids).change_counter(
+                model.counter_field, delta)
+        return on_change
+
+    def change_favorites(self, recipe_ids, delta):
+        """Обновляет счётчики и рейтинг популярных при изменении избранного."""
+        self.change_counters(Favorite)(recipe_ids, delta)
+        track_favorites(self.request.user.favorites.filter(
+            recipe_id__in=recipe_ids).values_list('recipe_id', 'created_at'),
+            delta)
+
+    def get_limit(self, default, maximum):
+        """Размер выдачи из параметра limit, не больше maximum."""
+        limit = self.request.query_params.get('limit', '')
+        return (min(int(limit), maximum)
+                if limit.isdigit() and int(limit) else default)
+
+    def ranked_response(self, ranked, field):
+        """
+        Ответ со списком рецептов в порядке ranked.
+
+        ranked — пары (id рецепта, значение); значение добавляется
+        к представлению рецепта полем field.
+        """
+        recipes = Recipe.objects.with_viewer_flags(
+            self.request.user).in_bulk([pk for pk, _ in ranked])
+        ranked = [(recipes[pk], value) for pk, value in ranked
+                  if pk in recipes]
+        data = self.get_serializer(
+            [recipe for recipe, _ in ranked], many=True).data
+        for item, (_, value) in zip(data, ranked):
+            item[field] = value
+        return Response({'results': data})
+
+    @action(methods=['get'], detail=False)
+    def cookable(self, request, *args, **kwargs):
+        """
+        Рецепты, которые можно приготовить из имеющихся ингредиентов.
+
+        Ингредиенты передаются параметром ingredients (через запятую или
+        несколькими параметрами). Рецепты ранжируются по доле своих
+        ингредиентов, входящих в набор, по индексу в памяти.
+        """
+        serializer = serializers.BatchIdsSerializer(data={'ids': [
+            value
+            for values in request.query_params.getlist('ingredients')
+            for value in values.split(',') if value
+        ]})
+        serializer.is_valid(raise_exception=True)
+        ranked = recipe_index.match(
+            serializer.validated_data['ids'],
+            self.get_limit(RECIPE_MATCH_LIMIT, RECIPE_MATCH_MAX_LIMIT))
+        return self.ranked_response(
+            [(pk, round(coverage, 3)) for pk, coverage in ranked],
+            'coverage')
 
     @action(methods=['get'], detail=False)
+    def popular(self, request, *args, **kwargs):
+        """
+        Рецепты, чаще всего добавляемые в избранное за последние дни.
+
+        Окно задаётся параметром window (в днях, из POPULAR_WINDOWS),
+        теги — параметрами tags со slug. Выдача берётся из рейтинга
+        в памяти, к базе обращается только загрузка самих рецептов.
+        """
+        window = request.query_params.get('window', str(POPULAR_WINDOWS[0]))
+        if not window.isdigit() or int(window) not in POPULAR_WINDOWS:
+            raise validators.ValidationError({'window': (
+                f'Допустимые значения: '
+                f'{", ".join(map(str, POPULAR_WINDOWS))}.')})
+        slugs = tag_slugs.get()
+        tags = request.query_params.getlist('tags')
+        unknown = [slug for slug in tags if slug not in slugs]
+        if unknown:
+            raise validators.ValidationError(
+                {'tags': f'Неизвестные теги: {", ".join(unknown)}.'})
+        return self.ranked_response(popular_recipes.top(
+            int(window), [slugs[slug] for slug in tags],
+            self.get_limit(POPULAR_LIMIT, POPULAR_TOP_SIZE)),
+            'recent_favorites')
+
+    @action(methods=['get'],
+            detail=False,
+            permission_classes=[permissions.IsAuthenticated])
     def download_shopping_cart(self, request, *args, **kwargs):
-        """Загрузка списка покупок в виде текстового файла."""
-        ingredient_list = []
-        for cart in request.user.shopcarts.all():
-            ingredient = cart.recipe.ingredients.values(
-                'id',
-                'name',
-                'measurement_unit',
-                amount=F('recipeingredient__amount')).all()
-            ingredient_list.extend(ingredient.values())
-
-        filename = scripts.txt_export(
-            scripts.combine_ingredients(ingredient_list))
-
-        with open(filename, 'rb') as file:
-            response = HttpResponse(file.read(), content_type='text/plain')
-
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        """
+        Загрузка списка покупок в виде текстового файла.
+
+        С параметром async файл формируется фоновой задачей, а в ответе
+        возвращается задача для опроса статуса.
+        """
+        if request.query_params.get('async'):
+            job = jobs.enqueue('export_shopping_cart', user=request.user,
+                               user_id=request.user.pk)
+            return Response(serializers.JobSerializer(job).data,
+                            status=status.HTTP_202_ACCEPTED)
+
+        ingredients = RecipeIngredient.objects.shopping_list(request.user)
+        response = StreamingHttpResponse(
+            scripts.txt_export(ingredients.iterator()),
+            content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = (
+            f'attachment; filename="{SHOPPING_CART_FILENAME}"')
         return response
 
     def perform_create_response(self, *args, **kwargs):
@@ -158,16 +343,63 @@ class RecipeViewSet(viewsets.ModelViewSet):
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
+    def perform_destroy_response(self, related_manager, error,
+                                 on_delete=None):
+        """
+        Удаляет связь пользователя с рецептом и возвращает ответ.
+        Уменьшает счётчик рецепта, если связь была удалена.
+        on_delete вызывается с queryset удаляемых связей до удаления.
+        """
+        recipe = self.get_object()
+        relations = related_manager.filter(recipe=recipe)
+        if on_delete is not None:
+            on_delete(relations)
+        deleted, _ = relations.delete()
+        if not deleted:
+            raise validators.ValidationError({'errors': error})
+        Recipe.objects.filter(pk=recipe.pk).change_counter(
+            related_manager.model.counter_field, -1)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class IngredientViewSet(mixins.IngredientTagViewSet):
-    """ViewSet для управления ингредиентами."""
+    """
+    ViewSet для управления ингредиентами.
+
+    Поиск по параметру name обслуживается из индекса в памяти
+    без обращения к базе данных.
+    """
     queryset = Ingredient.objects.all()
     serializer_class = serializers.IngredientReadSerializer
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilterSet
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit')
+        return Response(ingredient_index.search(
+            name, limit=int(limit) if limit and limit.isdigit() else None))
 
 
 class TagViewSet(mixins.IngredientTagViewSet):
     """ViewSet для управления тегами."""
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializer
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet для опроса статуса фоновых задач пользователя."""
+    serializer_class = serializers.JobSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return Job.objects.filter(created_by=self.request.user)
+
+
+@api_view(['GET'])
+@permission_classes([IsStaffOrMetricsToken])
+def metrics(request):
+    """Метрики всех воркеров в текстовом формате Prometheus."""
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,97 @@
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from .pool import PoolTimeout, get_pool
+
+Database = base.Database
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL с проверкой постоянных соединений и необязательным пулом.
+
+    CONN_HEALTH_CHECKS: переиспользуемое соединение проверяется
+    запросом SELECT 1 при первом обращении в каждом HTTP-запросе,
+    и оборванное соединение открывается заново, а не даёт ошибку.
+
+    POOL: {'MAX_SIZE': n, 'TIMEOUT': секунды} — соединения берутся
+    из общего для потоков процесса пула и возвращаются в него при
+    закрытии вместо разрыва.
+    """
+
+    health_check_done = False
+
+    @property
+    def pool(self):
+        options = self.settings_dict.get('POOL')
+        if not options:
+            return None
+        return get_pool((self.alias, self.settings_dict['NAME']),
+                        options['MAX_SIZE'], options['TIMEOUT'])
+
+    def connect(self):
+        self.health_check_done = True
+        super().connect()
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        while True:
+            try:
+                connection, reused = pool.acquire(
+                    lambda: super(DatabaseWrapper, self).get_new_connection(
+                        conn_params))
+            except PoolTimeout as error:
+                raise Database.OperationalError(str(error)) from error
+            if not reused:
+                return connection
+            if connection.closed or not self.ping(connection):
+                pool.discard(connection)
+                continue
+            self.isolation_level = self.settings_dict['OPTIONS'].get(
+                'isolation_level', connection.isolation_level)
+            return connection
+
+    def ping(self, connection):
+        if not self.settings_dict.get('CONN_HEALTH_CHECKS'):
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except Database.Error:
+            return False
+        return True
+
+    def ensure_connection(self):
+        if (self.connection is not None and not self.health_check_done
+                and self.settings_dict.get('CONN_HEALTH_CHECKS')):
+            self.health_check_done = True
+            if not self.in_atomic_block and not self.is_usable():
+                self.close()
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        connection = self.connection
+        if connection.closed:
+            return pool.discard()
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_IDLE:
+            return pool.release(connection)
+        if status in (extensions.TRANSACTION_STATUS_INTRANS,
+                      extensions.TRANSACTION_STATUS_INERROR):
+            try:
+                connection.rollback()
+            except Database.Error:
+                return pool.discard(connection)
+            return pool.release(connection)
+        pool.discard(connection)
@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    """Свободное соединение не появилось за отведённое время."""
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул соединений с базой для одного процесса.
+
+    Соединения выдаются потокам по одному; если все MAX_SIZE соединений
+    заняты, поток ждёт освобождения не дольше TIMEOUT секунд.
+    Свободные соединения выдаются в порядке LIFO, чтобы лишние
+    дольше простаивали и не держали прогретый кэш сервера.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = []
+        self._size = 0
+        self._condition = threading.Condition()
+        self.created = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def acquire(self, connect):
+        """
+        Возвращает пару (соединение, взято_из_пула).
+
+        connect вызывается без блокировки, когда можно открыть новое
+        соединение.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f'Нет свободных соединений за {self.timeout} с.')
+                self.waits += 1
+                self._condition.wait(remaining)
+            if self._idle:
+                return self._idle.pop(), True
+            self._size += 1
+        try:
+            connection = connect()
+        except BaseException:
+            self.discard()
+            raise
+        self.created += 1
+        return connection, False
+
+    def release(self, connection):
+        """Возвращает соединение в пул."""
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def discard(self, connection=None):
+        """Закрывает соединение и освобождает место в пуле."""
+        if connection is not None and not connection.closed:
+            connection.close()
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max_size': self.max_size,
+                'created': self.created,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+            }
+
+
+def get_pool(key, max_size, timeout):
+    """Пул для пары (псевдоним, имя базы); после fork создаётся заново."""
+    pool = pools.get(key)
+    if pool is None or pool.pid != os.getpid():
+        with pools_lock:
+            pool = pools.get(key)
+            if pool is None or pool.pid != os.getpid():
+                pool = pools[key] = ConnectionPool(max_size, timeout)
+    return pool
@@ -20,6 +20,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'colorfield',
     'djoser',
     'django_filters',
@@ -30,6 +31,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.instrumentation_middleware',
+    'api.middleware.replica_middleware',
+    'api.middleware.streaming_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,6 +63,13 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+ASGI_APPLICATION = 'backend.asgi.application'
+
+# Режим сервера: wsgi (gunicorn с синхронными воркерами) или asgi
+# (gunicorn с воркерами uvicorn и асинхронными представлениями чтения).
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -66,15 +77,46 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'backend.postgresql',
         'NAME': os.getenv('POSTGRES_DB', ''),
         'USER': os.getenv('POSTGRES_USER', ''),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'),
     }
 }
 
+# Пул соединений для воркеров с потоками: DB_POOL_SIZE соединений
+# на процесс, ожидание свободного не дольше DB_POOL_TIMEOUT секунд.
+# Соединения возвращаются в пул в конце запроса, поэтому
+# CONN_MAX_AGE не используется.
+
+if int(os.getenv('DB_POOL_SIZE', 0)):
+    DATABASES['default']['POOL'] = {
+        'MAX_SIZE': int(os.getenv('DB_POOL_SIZE')),
+        'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 5)),
+    }
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+
+# Реплики только для чтения: DB_REPLICA_HOSTS=replica1,replica2.
+# Остальные параметры подключения совпадают с основной базой.
+
+REPLICA_DATABASES = []
+
+for index, host in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -130,13 +172,62 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend'],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
 }
 
+# Кэш токенов аутентификации. Он должен быть общим для всех воркеров,
+# чтобы выход и смена пароля сразу действовали везде: по умолчанию это
+# файловый кэш, общий для воркеров gunicorn в одном контейнере. Для
+# нескольких контейнеров укажите TOKEN_CACHE_BACKEND и
+# TOKEN_CACHE_LOCATION (например, memcached).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'tokens': {
+        'BACKEND': os.getenv(
+            'TOKEN_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('TOKEN_CACHE_LOCATION', '/tmp/foodgram-tokens'),
+        'TIMEOUT': int(os.getenv('TOKEN_CACHE_TTL', 60)),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+INSTRUMENTATION_SAMPLE_RATE = float(
+    os.getenv('INSTRUMENTATION_SAMPLE_RATE', '0.05'))
+
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '500'))
+
+# Заголовок Server-Timing раскрывает время и число SQL-запросов, поэтому
+# по умолчанию он отдаётся только в режиме отладки и сотрудникам.
+
+SERVER_TIMING = os.getenv('SERVER_TIMING', str(DEBUG)) == 'True'
+
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+
+# Метрики отдаются сотрудникам и по общему токену в заголовке
+# Authorization: Bearer <METRICS_TOKEN> для сборщика Prometheus.
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': 'INFO'},
+        'recipes': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
 }
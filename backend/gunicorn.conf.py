@@ -0,0 +1,36 @@
+import os
+import threading
+
+bind = '0.0.0.0:8000'
+
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+
+if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+    wsgi_app = 'backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'backend.wsgi:application'
+
+
+def post_worker_init(worker):
+    """Строит индексы в памяти в фоне, не задерживая запуск воркера."""
+    from api.search import warm_up
+
+    threading.Thread(target=warm_up, daemon=True).start()
+
+
+def on_starting(server):
+    """Импортирует реестр метрик в мастере до запуска воркеров.
+
+    Обработчик child_exit вызывается из сигнала SIGCHLD, и импорт внутри
+    него прерывается выходом следующего воркера.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import api.metrics  # noqa: F401
+
+
+def child_exit(server, worker):
+    """Удаляет файлы метрик завершившегося воркера."""
+    from api.metrics import registry
+
+    registry.mark_process_dead(worker.pid)
@@ -13,6 +13,61 @@ RECIPE_MAX_LENG = 200
 RECIPE_MIN_COOK_VALUE = 1
 RECIPE_MAX_COOK_VALUE = 32000
 
+IMAGE_MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_QUALITY = 82
+IMAGE_FORMATS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+IMAGE_RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+
+JOB_NAME_MAX_LENG = 100
+JOB_STATUS_MAX_LENG = 10
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE_DELAY = 10
+JOB_POLL_INTERVAL = 1.0
+JOB_WORKERS = 2
+JOB_LEASE_SECONDS = 300
+EXPORT_UPLOAD_TO = 'exports/'
+EXPORT_TTL_SECONDS = 24 * 60 * 60
+EXPORT_CLEANUP_INTERVAL = 60 * 60
+
+SEARCH_CONFIG = 'russian'
+RECOUNT_BATCH_SIZE = 1000
+LOAD_BATCH_SIZE = 1000
+FEED_FANOUT_BATCH_SIZE = 1000
+FEED_BACKFILL_SIZE = 200
+
 # api constants
 
 PAGINATION_PAGE_SIZE = 6
+BATCH_MAX_SIZE = 100
+SHOPPING_CART_FILENAME = 'list_shopping_cart-export.txt'
+
+INGREDIENT_INDEX_TTL = 300
+NGRAM_SIZE = 3
+RECIPE_INDEX_TTL = 300
+RECIPE_MATCH_LIMIT = 20
+RECIPE_MATCH_MAX_LIMIT = 100
+
+POPULAR_WINDOWS = (7, 30)
+POPULAR_TOP_SIZE = 100
+POPULAR_LIMIT = 20
+POPULAR_REFRESH_INTERVAL = 30
+REFERENCE_CACHE_TTL = 300
+RECIPE_DOCUMENT_BATCH_SIZE = 500
+
+REPEATED_QUERY_THRESHOLD = 3
+SQL_LOG_MAX_LENG = 300
+
+METRICS_FLUSH_INTERVAL = 1.0
+METRICS_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+REPLICA_PIN_COOKIE = 'pin_primary'
+REPLICA_PIN_SECONDS = 10
+
+TOKEN_CACHE_ALIAS = 'tokens'
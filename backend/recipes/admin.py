@@ -3,7 +3,7 @@ from django.contrib.auth import get_user_model
 
 from .models import (
     Tag, Ingredient, Recipe, Favorite,
-    ShoppingCart, Subscription
+    Job, ShoppingCart, Subscription
 )
 
 User = get_user_model()
@@ -33,15 +33,10 @@ class IngredientAdmin(admin.ModelAdmin):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     """Администрирование рецептов."""
-    list_display = ('name', 'author')
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count')
     list_filter = ('author', 'name', 'tags')
     search_fields = ('name',)
-
-    def get_favorites_count(self, obj):
-        return obj.favorites.count()
-    get_favorites_count.short_description = 'Favorites Count'
-
-    readonly_fields = ('get_favorites_count',)
+    readonly_fields = ('favorites_count', 'in_carts_count')
 
 
 @admin.register(Favorite)
@@ -60,3 +55,11 @@ class ShoppingCartAdmin(admin.ModelAdmin):
 class SubscriptionAdmin(admin.ModelAdmin):
     """Администрирование подписок."""
     list_display = ('author', 'subcripe')
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Администрирование фоновых задач."""
+    list_display = ('name', 'status', 'attempts', 'run_at', 'created_by')
+    list_filter = ('name', 'status')
+    readonly_fields = ('created_at', 'updated_at')
@@ -0,0 +1,77 @@
+import io
+import posixpath
+import uuid
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from module.constants import (
+    IMAGE_FORMATS, IMAGE_MAX_PIXELS, IMAGE_QUALITY, IMAGE_RENDITIONS
+)
+
+
+def open_image(file):
+    """Открывает изображение с ограничением на число пикселей."""
+    image = Image.open(file)
+    if image.width * image.height > IMAGE_MAX_PIXELS:
+        raise ValueError('Слишком большое разрешение изображения.')
+    return image
+
+
+def sanitize(file):
+    """
+    Перекодирует изображение без метаданных.
+
+    Ориентация из EXIF применяется к пикселям, после чего EXIF и прочие
+    метаданные отбрасываются. Формат исходного файла определяется до
+    поворота: копия после exif_transpose его не хранит.
+    """
+    image = open_image(file)
+    source_format = image.format
+    image = ImageOps.exif_transpose(image)
+    output = io.BytesIO()
+    if source_format == 'PNG' or image.mode in ('RGBA', 'LA', 'P'):
+        image.save(output, 'PNG', optimize=True)
+        ext = 'png'
+    else:
+        image.convert('RGB').save(
+            output, 'JPEG', quality=IMAGE_QUALITY, optimize=True)
+        ext = 'jpg'
+    return ContentFile(output.getvalue(), name=f'{uuid.uuid4().hex}.{ext}')
+
+
+def rendition_name(name, rendition, extension):
+    """Путь варианта изображения в хранилище."""
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, rendition, f'{filename}.{extension}')
+
+
+def rendition_urls(image):
+    """Относительные URL всех вариантов изображения по размерам и форматам."""
+    if not image:
+        return None
+    return {
+        rendition: {
+            extension: default_storage.url(
+                rendition_name(image.name, rendition, extension))
+            for extension in IMAGE_FORMATS.values()
+        }
+        for rendition in IMAGE_RENDITIONS
+    }
+
+
+def create_renditions(image):
+    """Создаёт варианты изображения фиксированных размеров в JPEG и WebP."""
+    with image.open('rb') as file:
+        source = ImageOps.exif_transpose(open_image(file)).convert('RGB')
+    for rendition, size in IMAGE_RENDITIONS.items():
+        resized = source.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        for image_format, extension in IMAGE_FORMATS.items():
+            output = io.BytesIO()
+            resized.save(output, image_format,
+                         quality=IMAGE_QUALITY, optimize=True)
+            name = rendition_name(image.name, rendition, extension)
+            default_storage.delete(name)
+            default_storage.save(name, ContentFile(output.getvalue()))
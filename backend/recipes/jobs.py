@@ -0,0 +1,116 @@
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from module.constants import JOB_LEASE_SECONDS, JOB_RETRY_BASE_DELAY
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+def task(func):
+    """Регистрирует функцию как фоновую задачу под её именем."""
+    registry[func.__name__] = func
+    return func
+
+
+def enqueue(name, user=None, **payload):
+    """Ставит задачу в очередь и возвращает её запись."""
+    if name not in registry:
+        raise KeyError(f'Неизвестная задача: {name}')
+    return Job.objects.create(name=name, payload=payload, created_by=user)
+
+
+def claim():
+    """
+    Забирает одну готовую к запуску задачу.
+
+    Строка блокируется с SKIP LOCKED, поэтому параллельные обработчики
+    не получают одну и ту же задачу. Задача выдаётся в аренду до
+    locked_until, которую обработчик продлевает, пока её выполняет.
+    Задача с истёкшей арендой (обработчик упал или был остановлен)
+    выдаётся снова, а исчерпавшая попытки помечается ошибкой.
+    """
+    while True:
+        with transaction.atomic():
+            now = timezone.now()
+            job = Job.objects.select_for_update(skip_locked=True).filter(
+                Q(status=Job.PENDING, run_at__lte=now)
+                | Q(status=Job.RUNNING, locked_until__lt=now)
+            ).order_by('run_at', 'pk').first()
+            if job is None:
+                return None
+            if job.status == Job.RUNNING and job.attempts >= job.max_attempts:
+                job.status = Job.FAILED
+                job.locked_until = None
+                job.error = 'Обработчик не завершил задачу вовремя.'
+                job.save(update_fields=(
+                    'status', 'locked_until', 'error', 'updated_at'))
+                continue
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.locked_until = now + timedelta(seconds=JOB_LEASE_SECONDS)
+            job.save(update_fields=(
+                'status', 'attempts', 'locked_until', 'updated_at'))
+        return job
+
+
+@contextmanager
+def lease(job):
+    """Продлевает аренду задачи в фоновом потоке, пока она выполняется."""
+    stop = threading.Event()
+
+    def extend():
+        try:
+            while not stop.wait(JOB_LEASE_SECONDS / 3):
+                Job.objects.filter(
+                    pk=job.pk, status=Job.RUNNING, attempts=job.attempts
+                ).update(locked_until=timezone.now() + timedelta(
+                    seconds=JOB_LEASE_SECONDS))
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=extend, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run(job):
+    """
+    Выполняет задачу и сохраняет результат.
+
+    При ошибке задача возвращается в очередь с экспоненциальной
+    задержкой, пока не исчерпаны попытки.
+    """
+    try:
+        with lease(job):
+            job.result = registry[job.name](**job.payload)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.PENDING
+            job.run_at = timezone.now() + timedelta(
+                seconds=JOB_RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.FAILED
+        logger.exception('Задача %s #%s завершилась ошибкой',
+                         job.name, job.pk)
+    else:
+        job.status = Job.DONE
+        job.error = ''
+    job.locked_until = None
+    job.save(update_fields=(
+        'status', 'result', 'error', 'run_at', 'locked_until', 'updated_at'))
+    return job
@@ -0,0 +1,91 @@
+import json
+import random
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment
+)
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время ответа и SQL-запросы эндпоинтов API '
+            'на синтетических данных в отдельной тестовой базе '
+            'и во временном каталоге медиафайлов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='favorites per user')
+        parser.add_argument('--carts', type=int, default=10,
+                            help='shopping cart recipes per user')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='subscriptions per user')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--scenario', action='append',
+                            help='run only the given scenario')
+        parser.add_argument('--output', help='write results as JSON')
+        parser.add_argument('--baseline',
+                            help='compare against a stored JSON result')
+        parser.add_argument('--threshold', type=float, default=1.2,
+                            help='allowed p95 growth against the baseline')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='keep the test database between runs')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp(prefix='foodgram-benchmark-')
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                results, uncovered = self.measure(options)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.report(results, uncovered)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                regressions = benchmark.compare(
+                    results, json.load(file), options['threshold'])
+            if regressions:
+                raise CommandError(
+                    'Регрессии производительности:\n' + '\n'.join(regressions))
+            self.stdout.write('Регрессий нет.')
+
+    def measure(self, options):
+        setup_test_environment()
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            rng = random.Random(0)
+            benchmark.seed(
+                options['users'], options['recipes'], options['ingredients'],
+                options['tags'], options['favorites'], options['carts'],
+                options['subscriptions'], rng=rng)
+            return benchmark.run(
+                options['iterations'], only=options['scenario'], rng=rng)
+        finally:
+            teardown_databases(old_config, verbosity=0,
+                               keepdb=options['keepdb'])
+            teardown_test_environment()
+
+    def report(self, results, uncovered):
+        header = (f'{"scenario":<44}{"p50":>9}{"p95":>9}{"p99":>9}'
+                  f'{"sql ms":>9}{"queries":>9}  status')
+        self.stdout.write(header)
+        for key, result in results.items():
+            self.stdout.write(
+                f'{key:<44}{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+                f'{result["p99_ms"]:>9.2f}{result["sql_ms"]:>9.2f}'
+                f'{result["queries"]:>9}  {result["status"]}')
+        if uncovered:
+            self.stdout.write(
+                'Маршруты без сценариев: ' + ', '.join(uncovered))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.documents import recipe_documents
+from module.constants import RECIPE_DOCUMENT_BATCH_SIZE
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Строит готовые документы для чтения рецептов пакетами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=RECIPE_DOCUMENT_BATCH_SIZE,
+            help='number of recipes per update')
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='only recipes without a document')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if options['missing']:
+            recipes = recipes.filter(document__isnull=True)
+        updated = recipe_documents.rebuild(recipes, options['batch_size'])
+        self.stdout.write(f'Построено документов: {updated}')
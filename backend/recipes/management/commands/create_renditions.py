@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from recipes import tasks
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт варианты изображений для всех рецептов.'
+
+    def handle(self, *args, **options):
+        created = failed = 0
+        for pk in Recipe.objects.values_list('pk', flat=True).iterator():
+            try:
+                tasks.create_renditions(pk)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {pk}: {error}')
+            else:
+                created += 1
+        self.stdout.write(f'Обработано рецептов: {created}, ошибок: {failed}')
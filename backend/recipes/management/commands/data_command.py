@@ -1,34 +1,118 @@
+import csv
 import json
+from itertools import chain, islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from module.constants import LOAD_BATCH_SIZE
 from recipes.models import Ingredient, Tag
 
+MODELS = {
+    Tag: ('name', 'color', 'slug'),
+    Ingredient: ('name', 'measurement_unit'),
+}
+KEY_FIELDS = {
+    Tag: ('slug',),
+    Ingredient: ('name', 'measurement_unit'),
+}
+
+
+def iter_json(file, chunk_size=65536):
+    """Построчно читает объекты из JSON-массива, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer, started = '', False
+    for chunk in iter(lambda: file.read(chunk_size), ''):
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != '[':
+                    raise CommandError('Ожидается JSON-массив.')
+                buffer, started = buffer[1:], True
+                continue
+            if buffer[:1] in (',', ']'):
+                buffer = buffer[1:]
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                break
+            yield item
+            buffer = buffer[end:]
+    if buffer.strip():
+        raise CommandError('Некорректный JSON-файл.')
+
+
+def iter_csv(file, fields):
+    """Читает строки CSV без заголовка в порядке полей модели."""
+    for row in csv.reader(file):
+        if row:
+            yield dict(zip(fields, row))
+
 
 class Command(BaseCommand):
+    help = 'Загружает теги или ингредиенты из файла JSON или CSV.'
 
     def add_arguments(self, parser):
         parser.add_argument("--path", type=str, help="file path")
+        parser.add_argument(
+            "--model", choices=('tag', 'ingredient'), default='ingredient',
+            help="model for CSV files; JSON is detected by its keys")
+        parser.add_argument(
+            "--batch-size", type=int, default=LOAD_BATCH_SIZE,
+            help="rows per INSERT statement")
 
     def handle(self, *args, **options):
-        file_path = options["path"]
-
-        with open(file_path, encoding='utf-8') as f:
-            jsondata = json.load(f)
-            if 'color' in jsondata[0]:
-                for line in jsondata:
-                    if not Tag.objects.filter(
-                       slug=line['slug']).exists():
-                        Tag.objects.create(
-                            name=line['name'],
-                            color=line['color'],
-                            slug=line['slug'],
-                        )
-            elif 'measurement_unit' in jsondata[0]:
-                for line in jsondata:
-                    if not Ingredient.objects.filter(
-                       name=line['name'],
-                       measurement_unit=line['measurement_unit']).exists():
-                        Ingredient.objects.create(
-                            name=line['name'],
-                            measurement_unit=line['measurement_unit']
-                        )
+        path = Path(options["path"])
+        with open(path, encoding='utf-8', newline='') as f:
+            if path.suffix.lower() == '.csv':
+                model = Tag if options['model'] == 'tag' else Ingredient
+                rows = iter_csv(f, MODELS[model])
+            else:
+                rows = iter_json(f)
+                first = next(rows, None)
+                if first is None:
+                    return
+                model = Tag if 'color' in first else Ingredient
+                rows = chain([first], rows)
+            inserted, skipped = self.load(
+                model, rows, options['batch_size'])
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: добавлено {inserted}, '
+            f'пропущено {skipped}')
+
+    @staticmethod
+    def load(model, rows, batch_size):
+        """
+        Пакетно добавляет отсутствующие записи в одной транзакции.
+
+        Существующие ключи загружаются одним запросом, повторы во входных
+        данных и в базе пропускаются.
+        """
+        fields, key_fields = MODELS[model], KEY_FIELDS[model]
+        inserted = skipped = 0
+        with transaction.atomic():
+            seen = set(model.objects.values_list(*key_fields))
+            objs = (
+                model(**{field: row[field].strip() for field in fields})
+                for row in rows
+            )
+            while True:
+                chunk = list(islice(objs, batch_size))
+                if not chunk:
+                    break
+                batch = []
+                for obj in chunk:
+                    key = tuple(getattr(obj, field) for field in key_fields)
+                    if key in seen:
+                        skipped += 1
+                        continue
+                    seen.add(key)
+                    batch.append(obj)
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+                inserted += len(batch)
+        return inserted, skipped
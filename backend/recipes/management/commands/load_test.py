@@ -0,0 +1,35 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand
+
+from api import loadtest
+
+
+class Command(BaseCommand):
+    help = ('Нагружает запущенный сервер постоянными соединениями '
+            'и выводит пропускную способность и перцентили задержки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', required=True,
+                            help='GET endpoint, may be given several times')
+        parser.add_argument('--clients', type=int, default=500,
+                            help='concurrent keep-alive connections')
+        parser.add_argument('--duration', type=float, default=30)
+        parser.add_argument('--slow-clients', type=int, default=0,
+                            help='clients sending requests byte by byte')
+        parser.add_argument('--slow-delay', type=float, default=0.05,
+                            help='pause between bytes of a slow client')
+        parser.add_argument('--token', help='API token for requests')
+        parser.add_argument('--output', help='write the result as JSON')
+
+    def handle(self, *args, **options):
+        result = asyncio.run(loadtest.load(
+            options['url'], options['clients'], options['duration'],
+            options['token'], options['slow_clients'],
+            options['slow_delay']))
+        for key, value in result.items():
+            self.stdout.write(f'{key:<12}{value}')
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(result, file, indent=2)
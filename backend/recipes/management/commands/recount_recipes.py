@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from module.constants import RECOUNT_BATCH_SIZE
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного и списков покупок '
+            'рецептов пакетами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=RECOUNT_BATCH_SIZE,
+            help='number of recipes per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = Recipe.objects.order_by('pk').values_list('pk', flat=True)
+        last_id, updated = 0, 0
+        while True:
+            batch = list(ids.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                updated += Recipe.objects.filter(
+                    pk__gte=batch[0], pk__lte=batch[-1]).recount()
+            last_id = batch[-1]
+        self.stdout.write(f'Пересчитано рецептов: {updated}')
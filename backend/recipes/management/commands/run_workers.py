@@ -0,0 +1,62 @@
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from module.constants import (
+    EXPORT_CLEANUP_INTERVAL, JOB_POLL_INTERVAL, JOB_WORKERS
+)
+from recipes import jobs, tasks
+
+
+class Command(BaseCommand):
+    help = 'Запускает обработчики фоновых задач из очереди в базе данных.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=JOB_WORKERS,
+            help='number of worker threads')
+        parser.add_argument(
+            '--poll-interval', type=float, default=JOB_POLL_INTERVAL,
+            help='seconds to wait when the queue is empty')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: self.stopping.set())
+        signal.signal(signal.SIGINT, lambda *args: self.stopping.set())
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for _ in range(options['workers']):
+                pool.submit(
+                    self.work, options['poll_interval'], options['once'])
+            self.clean(options['once'])
+        self.stdout.write('Обработчики остановлены.')
+
+    def clean(self, once):
+        """Раз в EXPORT_CLEANUP_INTERVAL удаляет устаревшие выгрузки."""
+        while True:
+            deleted = tasks.delete_expired_exports()
+            if deleted:
+                self.stdout.write(f'Удалено выгрузок: {deleted}')
+            if once or self.stopping.wait(EXPORT_CLEANUP_INTERVAL):
+                return
+
+    def work(self, poll_interval, once):
+        """Цикл обработчика: забирает и выполняет задачи по одной."""
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                job = jobs.claim()
+                if job is None:
+                    if once:
+                        return
+                    self.stopping.wait(poll_interval)
+                    continue
+                jobs.run(job)
+                self.stdout.write(f'{job.name} #{job.pk}: {job.status}')
+        finally:
+            connection.close()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает поисковые векторы всех рецептов.'
+
+    def handle(self, *args, **options):
+        updated = Recipe.objects.update_search_vector()
+        self.stdout.write(f'Обновлено рецептов: {updated}')
@@ -1,15 +1,41 @@
+from collections import Counter, defaultdict
+
 from colorfield.fields import ColorField
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models.expressions import RawSQL, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
 
 from module.constants import (
     ING_MAX_LENG, ING_MAX_AMOUNT_VALUE, ING_MIN_AMOUNT_VALUE,
+    FEED_BACKFILL_SIZE, FEED_FANOUT_BATCH_SIZE, JOB_MAX_ATTEMPTS,
+    JOB_NAME_MAX_LENG, JOB_STATUS_MAX_LENG,
     RECIPE_MAX_COOK_VALUE, RECIPE_MAX_LENG, RECIPE_MIN_COOK_VALUE,
-    TAG_MAX_LENG, USER_MAX_LENG, USERNAME_LENG
+    SEARCH_CONFIG, TAG_MAX_LENG, USER_MAX_LENG, USERNAME_LENG
 )
 
 
+class FoodGramUserQuerySet(models.QuerySet):
+    """QuerySet пользователей с выборками для подписок."""
+
+    def with_recipes_count(self):
+        """Аннотирует пользователей количеством их рецептов."""
+        recipes = Recipe.objects.filter(
+            author=models.OuterRef('pk')
+        ).order_by().values('author').annotate(
+            count=models.Count('pk')).values('count')
+        return self.annotate(recipes_count=Coalesce(
+            models.Subquery(recipes, output_field=models.IntegerField()), 0))
+
+
+class FoodGramUserManager(UserManager.from_queryset(FoodGramUserQuerySet)):
+    """Менеджер пользователей FoodGram."""
+
+
 class FoodGramUser(AbstractUser):
     """Пользователь FoodGram."""
     email = models.EmailField('Адрес электронной почты', unique=True)
@@ -19,6 +45,8 @@ class FoodGramUser(AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
 
+    objects = FoodGramUserManager()
+
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
@@ -55,11 +83,113 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ('name',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_name_unit'
+            )
+        ]
 
     def __str__(self) -> str:
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet рецептов с выборками для чтения."""
+
+    def with_viewer_flags(self, user):
+        """
+        Аннотирует рецепты флагами текущего пользователя.
+
+        Флаги is_favorited, is_in_shopping_cart и author_is_subscribed
+        вычисляются подзапросами EXISTS. Остальное представление рецепта
+        читается из готового документа (поле document), поэтому страница
+        рецептов стоит одного запроса; связи рецептов без документа
+        дозагружает RecipeReadSerializer.
+        """
+        if user.is_authenticated:
+            flags = {
+                'is_favorited': models.Exists(Favorite.objects.filter(
+                    author=user, recipe=models.OuterRef('pk'))),
+                'is_in_shopping_cart': models.Exists(
+                    ShoppingCart.objects.filter(
+                        author=user, recipe=models.OuterRef('pk'))),
+                'author_is_subscribed': models.Exists(
+                    Subscription.objects.filter(
+                        author=user, subcripe=models.OuterRef('author'))),
+            }
+        else:
+            flags = {
+                name: models.Value(False, output_field=models.BooleanField())
+                for name in ('is_favorited', 'is_in_shopping_cart',
+                             'author_is_subscribed')
+            }
+        return self.defer('search_vector').annotate(**flags)
+
+    @staticmethod
+    def _relations():
+        return (
+            'tags',
+            models.Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient')
+            )
+        )
+
+    def with_relations(self):
+        """Загружает заранее автора, теги и ингредиенты рецептов."""
+        return self.select_related('author').prefetch_related(
+            *self._relations())
+
+    def prefetch_relations(self, recipes):
+        """Дозагружает автора, теги и ингредиенты полученных рецептов."""
+        models.prefetch_related_objects(recipes, 'author', *self._relations())
+
+    def first_per_author(self, limit):
+        """
+        Оставляет не более limit первых рецептов каждого автора.
+
+        Рецепты нумеруются оконной функцией ROW_NUMBER в разрезе автора
+        в порядке сортировки рецептов.
+        """
+        ranked = self.annotate(row_number=Window(
+            RowNumber(),
+            partition_by=models.F('author'),
+            order_by=[models.F(field) for field in (*Recipe._meta.ordering,
+                                                    'pk')]
+        )).order_by().values('pk', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) AS ranked WHERE row_number <= %s',
+            (*params, limit)
+        ))
+
+    def change_counter(self, field, delta):
+        """Атомарно изменяет счётчик рецептов на delta."""
+        return self.update(**{field: models.F(field) + delta})
+
+    def recount(self):
+        """Пересчитывает счётчики избранного и списков покупок."""
+        return self.update(**{
+            model.counter_field: Coalesce(models.Subquery(
+                model.objects.filter(
+                    recipe=models.OuterRef('pk')
+                ).order_by().values('recipe').annotate(
+                    count=models.Count('pk')).values('count'),
+                output_field=models.IntegerField()
+            ), 0)
+            for model in (Favorite, ShoppingCart)
+        })
+
+    def update_search_vector(self):
+        """Пересчитывает поисковый вектор по названию и описанию."""
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+        ))
+
+
 class Recipe(models.Model):
     """Рецепт блюда."""
     name = models.CharField('Название', max_length=RECIPE_MAX_LENG)
@@ -89,17 +219,47 @@ class Recipe(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Автор'
     )
+    search_vector = SearchVectorField(
+        'Поисковый вектор', null=True, editable=False)
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField(
+        'В списках покупок', default=0, editable=False)
+    document = models.JSONField(
+        'Документ для чтения', null=True, editable=False)
+    renditions_ready = models.BooleanField(
+        'Варианты изображения созданы', default=False, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         default_related_name = 'recipes'
         ordering = ('name',)
+        indexes = [
+            GinIndex(fields=['search_vector'], name='recipe_search_idx'),
+            GinIndex(fields=['name'], name='recipe_name_trgm_idx',
+                     opclasses=['gin_trgm_ops']),
+            models.Index(fields=['-favorites_count', 'id'],
+                         name='recipe_popular_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.name
 
 
+class RecipeIngredientQuerySet(models.QuerySet):
+    """QuerySet ингредиентов рецептов."""
+
+    def shopping_list(self, user):
+        """Суммарное количество ингредиентов из списка покупок."""
+        return self.filter(recipe__shopcarts__author=user).values(
+            name=models.F('ingredient__name'),
+            measurement_unit=models.F('ingredient__measurement_unit')
+        ).annotate(amount=models.Sum('amount')).order_by('name')
+
+
 class RecipeIngredient(models.Model):
     """Промежуточная модель для хранения ингредиентов рецепта."""
     recipe = models.ForeignKey(
@@ -126,6 +286,8 @@ class RecipeIngredient(models.Model):
         ]
     )
 
+    objects = RecipeIngredientQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ингредиент рецепта'
         verbose_name_plural = 'Ингредиенты рецептов'
@@ -149,14 +311,18 @@ class AuthorRecipeFieldsBase(models.Model):
         constraints = [
             models.UniqueConstraint(
                 fields=['author', 'recipe'],
-                name='unique_author_recipe'
+                name='%(class)s_unique_author_recipe'
             )
         ]
 
 
 class Favorite(AuthorRecipeFieldsBase):
     """Избранный рецепт."""
-    class Meta:
+    counter_field = 'favorites_count'
+    created_at = models.DateTimeField('Добавлен', auto_now_add=True,
+                                      null=True)
+
+    class Meta(AuthorRecipeFieldsBase.Meta):
         verbose_name = 'Избранный'
         verbose_name_plural = 'Избранные'
         default_related_name = 'favorites'
@@ -167,7 +333,9 @@ class Favorite(AuthorRecipeFieldsBase):
 
 class ShoppingCart(AuthorRecipeFieldsBase):
     """Список покупок."""
-    class Meta:
+    counter_field = 'in_carts_count'
+
+    class Meta(AuthorRecipeFieldsBase.Meta):
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупоки'
         default_related_name = 'shopcarts'
@@ -176,6 +344,66 @@ class ShoppingCart(AuthorRecipeFieldsBase):
         return self.author.username
 
 
+class FavoriteDayQuerySet(models.QuerySet):
+    """QuerySet дневных счётчиков избранного."""
+
+    def change(self, recipe_ids, delta, day):
+        """
+        Атомарно изменяет счётчики рецептов за день на delta.
+
+        Отсутствующие строки сначала создаются с нулевым счётчиком,
+        затем счётчики увеличиваются выражением F; повторяющийся
+        в recipe_ids рецепт изменяется на delta столько раз, сколько раз
+        он указан.
+        """
+        repeats = defaultdict(list)
+        for recipe_id, times in Counter(recipe_ids).items():
+            repeats[times].append(recipe_id)
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            self.bulk_create(
+                [self.model(recipe_id=recipe_id, day=day)
+                 for recipe_ids in repeats.values()
+                 for recipe_id in recipe_ids],
+                ignore_conflicts=True)
+            for times, recipe_ids in repeats.items():
+                self.filter(day=day, recipe_id__in=recipe_ids).update(
+                    count=models.F('count') + times * delta,
+                    updated_at=timezone.now())
+
+
+class FavoriteDay(models.Model):
+    """Число добавлений рецепта в избранное за день."""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='favorite_days',
+        verbose_name='Рецепт'
+    )
+    day = models.DateField('День')
+    count = models.IntegerField('Добавлений', default=0)
+    updated_at = models.DateTimeField('Обновлён', auto_now=True)
+
+    objects = FavoriteDayQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Избранное за день'
+        verbose_name_plural = 'Избранное по дням'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'day'],
+                name='unique_favorite_day_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='favorite_day_idx'),
+            models.Index(fields=['updated_at'],
+                         name='favorite_day_updated_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.recipe_id}: {self.day}'
+
+
 class Subscription(models.Model):
     """Подписка на пользователя."""
     author = models.ForeignKey(
@@ -202,3 +430,135 @@ class Subscription(models.Model):
 
     def __str__(self) -> str:
         return self.author.username
+
+
+class FeedEntryQuerySet(models.QuerySet):
+    """QuerySet ленты подписок."""
+
+    def fan_out(self, recipe, batch_size=FEED_FANOUT_BATCH_SIZE):
+        """
+        Добавляет рецепт в ленты всех подписчиков его автора.
+
+        Подписчики перебираются по первичному ключу подписки, записи
+        вставляются пакетами по batch_size. Возвращает число подписчиков.
+        """
+        followers = Subscription.objects.filter(
+            subcripe_id=recipe.author_id
+        ).order_by('pk').values_list('pk', 'author_id')
+        last_id, total = 0, 0
+        while True:
+            batch = list(followers.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                return total
+            self.bulk_create(
+                (FeedEntry(user_id=user_id, recipe_id=recipe.pk)
+                 for _, user_id in batch),
+                ignore_conflicts=True)
+            total += len(batch)
+            last_id = batch[-1][0]
+
+    def backfill(self, user, author_ids, limit=FEED_BACKFILL_SIZE):
+        """Добавляет в ленту пользователя limit новых рецептов авторов."""
+        recipe_ids = Recipe.objects.filter(
+            author__in=author_ids
+        ).order_by('-pk').values_list('pk', flat=True)[:limit]
+        self.bulk_create(
+            (FeedEntry(user=user, recipe_id=pk) for pk in recipe_ids),
+            ignore_conflicts=True)
+
+    def prune(self, user, author_ids):
+        """Удаляет из ленты пользователя рецепты авторов."""
+        return self.filter(
+            user=user, recipe__author__in=author_ids).delete()
+
+
+class FeedEntry(models.Model):
+    """
+    Рецепт в ленте подписок пользователя.
+
+    Лента заполняется при публикации рецепта и при подписке, поэтому
+    её чтение — просмотр диапазона индекса (user, recipe) в порядке
+    убывания идентификатора рецепта.
+    """
+    user = models.ForeignKey(
+        FoodGramUser,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        ordering = ('-recipe_id',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_user_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-recipe', 'id'],
+                         name='feed_user_recipe_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.user_id}: {self.recipe_id}'
+
+
+class Job(models.Model):
+    """Фоновая задача в очереди."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField('Задача', max_length=JOB_NAME_MAX_LENG)
+    payload = models.JSONField('Параметры', default=dict)
+    status = models.CharField(
+        'Статус', max_length=JOB_STATUS_MAX_LENG,
+        choices=STATUSES, default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField('Попытки', default=0)
+    max_attempts = models.PositiveSmallIntegerField(
+        'Максимум попыток', default=JOB_MAX_ATTEMPTS)
+    run_at = models.DateTimeField('Запуск не раньше', default=timezone.now)
+    locked_until = models.DateTimeField(
+        'Выполняется до', null=True, blank=True)
+    result = models.JSONField('Результат', null=True, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    created_by = models.ForeignKey(
+        FoodGramUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='jobs',
+        verbose_name='Автор'
+    )
+    created_at = models.DateTimeField('Создана', auto_now_add=True)
+    updated_at = models.DateTimeField('Обновлена', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_queue_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.name} ({self.status})'
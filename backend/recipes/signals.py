@@ -0,0 +1,21 @@
+from django.db import connections
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Recipe
+
+
+def create_extensions(using, **kwargs):
+    """Создаёт расширения PostgreSQL, необходимые для индексов."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_vector(sender, instance, update_fields, **kwargs):
+    """Обновляет поисковый вектор рецепта после сохранения."""
+    if update_fields and not {'name', 'text'} & set(update_fields):
+        return
+    Recipe.objects.filter(pk=instance.pk).update_search_vector()
@@ -0,0 +1,80 @@
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from api.documents import recipe_documents
+from module import scripts
+from module.constants import EXPORT_TTL_SECONDS, EXPORT_UPLOAD_TO
+from . import images
+from .jobs import task
+from .models import FeedEntry, Recipe, RecipeIngredient
+
+User = get_user_model()
+
+
+@task
+def create_renditions(recipe_id):
+    """
+    Создаёт варианты изображения рецепта.
+
+    После создания рецепт отмечается renditions_ready, если его
+    изображение за это время не заменили; сохранение перестраивает
+    документ рецепта, и ссылки на варианты появляются в ответах.
+    """
+    recipe = Recipe.objects.only('image').get(pk=recipe_id)
+    images.create_renditions(recipe.image)
+    with transaction.atomic():
+        current = Recipe.objects.select_for_update().only(
+            'image', 'renditions_ready').get(pk=recipe_id)
+        if (current.image.name == recipe.image.name
+                and not current.renditions_ready):
+            current.renditions_ready = True
+            current.save(update_fields=['renditions_ready'])
+    return {'images': images.rendition_urls(recipe.image)}
+
+
+@task
+def fan_out_recipe(recipe_id):
+    """Добавляет новый рецепт в ленты подписчиков автора."""
+    recipe = Recipe.objects.only('author').filter(pk=recipe_id).first()
+    if recipe is None:
+        return {'followers': 0}
+    return {'followers': FeedEntry.objects.fan_out(recipe)}
+
+
+@task
+def rebuild_author_documents(author_id):
+    """Перестраивает документы рецептов автора после изменения его данных."""
+    return {'recipes': recipe_documents.rebuild(
+        Recipe.objects.filter(author_id=author_id))}
+
+
+@task
+def export_shopping_cart(user_id):
+    """Формирует файл списка покупок пользователя в хранилище."""
+    ingredients = RecipeIngredient.objects.shopping_list(
+        User.objects.get(pk=user_id))
+    content = ''.join(scripts.txt_export(ingredients.iterator()))
+    name = default_storage.save(
+        f'{EXPORT_UPLOAD_TO}{uuid.uuid4().hex}.txt',
+        ContentFile(content.encode('utf-8')))
+    return {'url': default_storage.url(name)}
+
+
+def delete_expired_exports():
+    """Удаляет файлы списков покупок старше EXPORT_TTL_SECONDS."""
+    if not default_storage.exists(EXPORT_UPLOAD_TO):
+        return 0
+    deadline = timezone.now() - timedelta(seconds=EXPORT_TTL_SECONDS)
+    deleted = 0
+    for filename in default_storage.listdir(EXPORT_UPLOAD_TO)[1]:
+        name = f'{EXPORT_UPLOAD_TO}{filename}'
+        if default_storage.get_modified_time(name) < deadline:
+            default_storage.delete(name)
+            deleted += 1
+    return deleted